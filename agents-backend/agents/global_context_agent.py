@@ -2,16 +2,20 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from tools.global_context_tools import get_global_context_tools
-from langchain_ollama import ChatOllama
-from langgraph.prebuilt import create_react_agent
+from tools.global_context_tools import get_global_context_tools, global_context_cache, global_context_key, normalize_location
+from agents.llm_config import create_llm
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import StateGraph, MessagesState, START, END
+from langgraph.prebuilt import ToolNode, create_react_agent
+from job_context import handle_tool_error
 from dotenv import load_dotenv
 load_dotenv()
 
 class GlobalContextAgent:
     def __init__(self):
         self.tools = get_global_context_tools()
-        self.llm = ChatOllama(model="gpt-oss:20b", temperature=0)
+        self.llm = create_llm(temperature=0, agent="global_context_agent")
         
         self.system_prompt = """You are an autonomous agent that can use the following tools to answer questions:
         get_current_time: Get the current time and date
@@ -30,10 +34,32 @@ class GlobalContextAgent:
         DO NOT keep searching after you have the basic information you need."""
 
     def get_agent(self):
-        """Get the global context agent instance"""
-        return create_react_agent(
+        """Get the global context agent instance.
+
+        The agent reuses a location's context for the current time bucket in
+        every graph mode. The location is read from config["configurable"]["location"]
+        (see MainGraph.run_config) and normalized to town and country; concurrent
+        requests for one location share a single agent run.
+        """
+        agent = create_react_agent(
             model=self.llm.bind_tools(self.tools),
             prompt=self.system_prompt,
-            tools=self.tools,
+            tools=ToolNode(self.tools, handle_tool_errors=handle_tool_error),
             name="global_context_agent"
-        )
\ No newline at end of file
+        )
+
+        def run(state: MessagesState, config: RunnableConfig):
+            location = (config.get("configurable") or {}).get("location")
+            if not location or not normalize_location(location):
+                return {"messages": [agent.invoke(state, config)["messages"][-1]]}
+            content = global_context_cache.get_or_compute(
+                global_context_key(location),
+                lambda: agent.invoke(state, config)["messages"][-1].content,
+            )
+            return {"messages": [AIMessage(content=content, name="global_context_agent")]}
+
+        builder = StateGraph(MessagesState)
+        builder.add_node("global_context_agent", run)
+        builder.add_edge(START, "global_context_agent")
+        builder.add_edge("global_context_agent", END)
+        return builder.compile(name="global_context_agent")
\ No newline at end of file
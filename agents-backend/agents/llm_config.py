@@ -1,69 +1,137 @@
 """
 LLM configuration for different providers
 Choose your preferred LLM provider here
+
+All agents get their chat model from create_llm, which shares one client (and
+so one HTTP connection pool) between agents using the same settings. Per-agent
+overrides are read from <AGENT_NAME>_LLM_MODEL and <AGENT_NAME>_LLM_TEMPERATURE,
+e.g. GLOBAL_CONTEXT_AGENT_LLM_MODEL=gpt-oss:20b.
+
+Ollama and OpenAI get a keep-alive httpx client capped at LLM_MAX_CONNECTIONS.
+ChatAnthropic accepts no client, but already reuses one cached keep-alive
+client per base URL; LLM_MAX_CONNECTIONS does not apply to it, and its
+concurrent calls are bounded by MAX_CONCURRENT_LLM_ANTHROPIC instead.
+
+Models running at temperature 0 are deterministic, so their responses are
+served from the shared LLM response cache (see llm_cache.py).
 """
 
 import os
+import threading
+import httpx
+from agents.llm_cache import get_llm_cache
 from dotenv import load_dotenv
 load_dotenv()
 
 # LLM Provider Configuration
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "ollama")  # Options: ollama, openai, anthropic
 
+# Connections kept open to the provider, shared by every agent using the same client
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "8"))
+
 def get_llm_config():
     """Get LLM configuration based on provider"""
-    
+
     if LLM_PROVIDER == "openai":
         from langchain_openai import ChatOpenAI
         return {
             "class": ChatOpenAI,
-            "model": "gpt-4o-mini",  # or gpt-4o for better quality
+            "model": os.getenv("OPENAI_MODEL", "gpt-4o-mini"),  # or gpt-4o for better quality
             "temperature": 0.7,
             "api_key": os.getenv("OPENAI_API_KEY")
         }
-    
+
     elif LLM_PROVIDER == "anthropic":
         from langchain_anthropic import ChatAnthropic
         return {
             "class": ChatAnthropic,
-            "model": "claude-3-haiku-20240307",  # or claude-3-sonnet-20240229
+            "model": os.getenv("ANTHROPIC_MODEL", "claude-3-haiku-20240307"),  # or claude-3-sonnet-20240229
             "temperature": 0.7,
             "api_key": os.getenv("ANTHROPIC_API_KEY")
         }
-    
+
     elif LLM_PROVIDER == "ollama":
         from langchain_ollama import ChatOllama
+        num_ctx = os.getenv("OLLAMA_NUM_CTX")
+        keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "-1")
         return {
             "class": ChatOllama,
-            "model": "gpt-oss:20b",
+            "model": os.getenv("OLLAMA_MODEL", "gpt-oss:20b"),
             "temperature": 0.7,
-            "base_url": "http://localhost:11434"  # Ollama default port
+            "base_url": os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"),  # Ollama default port
+            # Keep the model resident between requests instead of Ollama's 5 minute default
+            # (a negative number keeps it loaded indefinitely; durations like "30m" also work)
+            "keep_alive": int(keep_alive) if keep_alive.lstrip("-").isdigit() else keep_alive,
+            "num_ctx": int(num_ctx) if num_ctx else None,
         }
-    
+
     else:
         raise ValueError(f"Unsupported LLM provider: {LLM_PROVIDER}")
 
-def create_llm(temperature=0.7):
-    """Create an LLM instance with the configured provider"""
+def get_agent_overrides(agent: str) -> dict:
+    """Read per-agent model/temperature overrides from the environment"""
+    prefix = agent.upper()
+    overrides = {}
+    if os.getenv(f"{prefix}_LLM_MODEL"):
+        overrides["model"] = os.getenv(f"{prefix}_LLM_MODEL")
+    if os.getenv(f"{prefix}_LLM_TEMPERATURE"):
+        overrides["temperature"] = float(os.getenv(f"{prefix}_LLM_TEMPERATURE"))
+    return overrides
+
+# Clients are shared between agents with identical settings so they share a connection pool
+_llm_instances = {}
+_llm_instances_lock = threading.Lock()
+
+def create_llm(temperature=0.7, agent: str = None, cache: bool = None):
+    """Create (or reuse) an LLM instance with the configured provider.
+
+    agent names the calling agent so its overrides from the environment apply.
+    cache enables the response cache; by default only temperature 0 models use it.
+    """
     config = get_llm_config()
-    
+    model = config["model"]
+    if agent:
+        overrides = get_agent_overrides(agent)
+        model = overrides.get("model", model)
+        temperature = overrides.get("temperature", temperature)
+    if cache is None:
+        cache = temperature == 0
+
+    key = (LLM_PROVIDER, model, temperature, cache)
+    with _llm_instances_lock:
+        if key not in _llm_instances:
+            _llm_instances[key] = _build_llm(config, model, temperature, get_llm_cache() if cache else None)
+        return _llm_instances[key]
+
+def _build_llm(config: dict, model: str, temperature: float, cache=None):
+    # cache=None leaves LangChain's global cache setting (off by default) in charge
+    limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+
     if LLM_PROVIDER == "openai":
         return config["class"](
-            model=config["model"],
+            model=model,
             temperature=temperature,
-            api_key=config["api_key"]
+            api_key=config["api_key"],
+            http_client=httpx.Client(limits=limits),
+            cache=cache,
         )
-    
+
     elif LLM_PROVIDER == "anthropic":
+        # No http_client option; ChatAnthropic shares its own pooled client (see the module docstring)
         return config["class"](
-            model=config["model"],
+            model=model,
             temperature=temperature,
-            api_key=config["api_key"]
+            api_key=config["api_key"],
+            cache=cache,
         )
-    
+
     elif LLM_PROVIDER == "ollama":
         return config["class"](
-            model=config["model"],
+            model=model,
             temperature=temperature,
-            base_url=config["base_url"]
+            base_url=config["base_url"],
+            keep_alive=config["keep_alive"],
+            num_ctx=config["num_ctx"],
+            client_kwargs={"limits": limits},
+            cache=cache,
         )
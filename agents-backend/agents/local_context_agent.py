@@ -3,21 +3,25 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from tools.local_context_tools import get_local_context_tools
-from langchain_ollama import ChatOllama
-from langgraph.prebuilt import create_react_agent
+from agents.llm_config import create_llm
+from langgraph.prebuilt import ToolNode, create_react_agent
+from job_context import handle_tool_error
 from dotenv import load_dotenv
 load_dotenv()
 
 class LocalContextAgent:
     def __init__(self):
         self.tools = get_local_context_tools()
-        self.llm = ChatOllama(model="gpt-oss:20b", temperature=0.3)
+        self.llm = create_llm(temperature=0.3, agent="local_context_agent")
         
         self.system_prompt = """You are an autonomous agent that can use the following tools to answer questions:
         get_image_caption: Get the caption of an image uploaded by the user to understand the environment the user is in. This tool is a image to text model that can caption images with a conditioning prompt.
+        get_image_captions: Caption the same image with a list of prompts in one call. Prefer this when you want several kinds of information at once.
 
-        Your goal is to understand the environment the user is in. You should always use the get_image_caption tool to understand the environment the user is in.
-        You can call this tool a MAXIMUM of 3 times. You can use a prompt to get specific information about the environment the user is in.
+        The image in the user's request may be a URL, a local file path or an upload:// reference. Pass it to the tools exactly as given.
+
+        Your goal is to understand the environment the user is in. You should always use the captioning tools to understand the environment the user is in.
+        You can call these tools a MAXIMUM of 3 times in total. You can use a prompt to get specific information about the environment the user is in.
         After an initial prompt, you can use the get_image_caption tool to get more specific information about the environment the user is in.
         You should return a response that the supervisor agent can use to understand the environment the user is in and generate music for. 
 
@@ -31,6 +35,6 @@ class LocalContextAgent:
         return create_react_agent(
             model=self.llm.bind_tools(self.tools),
             prompt=self.system_prompt,
-            tools=self.tools,
+            tools=ToolNode(self.tools, handle_tool_errors=handle_tool_error),
             name="local_context_agent"
         )
\ No newline at end of file
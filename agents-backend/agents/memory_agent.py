@@ -3,13 +3,14 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from tools.vector_memory_tools import get_vector_memory_tools
-from langchain_ollama import ChatOllama
-from langgraph.prebuilt import create_react_agent
+from agents.llm_config import create_llm
+from langgraph.prebuilt import ToolNode, create_react_agent
+from job_context import handle_tool_error
 
 class MemoryAgent:
     def __init__(self):
         self.tools = get_vector_memory_tools()
-        self.llm = ChatOllama(model="gpt-oss:20b", temperature=0.3)
+        self.llm = create_llm(temperature=0.3, agent="memory_agent")
         
         self.system_prompt = """You are a memory management agent responsible for storing and retrieving information from the vector database.
 
@@ -42,6 +43,6 @@ class MemoryAgent:
         return create_react_agent(
             model=self.llm.bind_tools(self.tools),
             prompt=self.system_prompt,
-            tools=self.tools,
+            tools=ToolNode(self.tools, handle_tool_errors=handle_tool_error),
             name="memory_agent"
         )
@@ -3,13 +3,14 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from tools.reinforcement_tools import get_reinforcement_tools
-from langchain_ollama import ChatOllama
-from langgraph.prebuilt import create_react_agent
+from agents.llm_config import create_llm
+from langgraph.prebuilt import ToolNode, create_react_agent
+from job_context import handle_tool_error
 
 class ReinforcementAgent:
     def __init__(self):
         self.tools = get_reinforcement_tools()
-        self.llm = ChatOllama(model="gpt-oss:20b", temperature=0.2)
+        self.llm = create_llm(temperature=0.2, agent="reinforcement_agent")
         
         self.system_prompt = """You are a reinforcement learning agent responsible for learning from user feedback and improving music recommendations.
 
@@ -41,6 +42,6 @@ class ReinforcementAgent:
         return create_react_agent(
             model=self.llm.bind_tools(self.tools),
             prompt=self.system_prompt,
-            tools=self.tools,
+            tools=ToolNode(self.tools, handle_tool_errors=handle_tool_error),
             name="reinforcement_agent"
         )
@@ -4,7 +4,7 @@ from .llm_config import create_llm
 
 class SupervisorAgent:
     def __init__(self):
-        self.llm = create_llm(temperature=0.7)
+        self.llm = create_llm(temperature=0.7, agent="supervisor")
         self.prompt = """"
         You are the supervisor agent. Your role is to coordinate subagents so music is generated for the user’s mood and environment.
         
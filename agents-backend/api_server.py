@@ -1,10 +1,28 @@
-from fastapi import WebSocket, WebSocketDisconnect, FastAPI, HTTPException
+from fastapi import WebSocket, WebSocketDisconnect, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError, field_validator
 import uvicorn
 from main_graph import MainGraph
+from scheduler import job_scheduler, SchedulerBusy
+from job_store import JobStore, SUCCEEDED
+from job_manager import JobManager, LIVE_ONLY_FIELDS, TERMINAL_EVENTS
+from model_registry import model_registry
+from metrics import metrics
+from agents.llm_cache import get_llm_cache
+from tools.global_context_tools import search_cache, global_context_cache
+from tools.image_fetch import IMAGE_MAX_BYTES, ImageFetchError, store_upload
+from tools.music_generation_tools import QUALITY_PRESETS, get_stable_audio
+from tools.artifact_store import artifact_store
+from tools.loop_synthesis import LOOP_MAX_DURATION_SECONDS
+from tools.audio_delivery import (
+    AUDIO_FORMATS, STEM_STREAM_FORMAT, STREAMABLE_WHILE_ENCODING, audio_encoder, encode_audio, iter_file, negotiate, parse_range,
+)
 import asyncio
+import email.policy
 import json
+import os
+from email.parser import BytesParser
 from typing import Optional
 
 app = FastAPI(title="Intelligent Ambience API", version="1.0.0")
@@ -20,54 +38,303 @@ app.add_middleware(
 
 # Global instance - initialized once on startup
 main_graph = None
+job_store = JobStore()
+job_manager = JobManager(job_store, job_scheduler)
 
 class AmbienceRequest(BaseModel):
     query: str
     img_url: Optional[str] = "no image provided"
     user_feedback: Optional[str] = ""
+    # Music quality preset (draft, standard, high); defaults to MUSIC_PRESET
+    preset: Optional[str] = None
+    # Stream a draft render of every layer before the refined one
+    progressive: Optional[bool] = False
+    seed: Optional[int] = None
+    # Length of the soundscape in seconds; the generated layers are looped to fill it
+    duration: Optional[float] = None
+
+    @field_validator("preset")
+    @classmethod
+    def check_preset(cls, preset):
+        if preset is not None and preset not in QUALITY_PRESETS:
+            raise ValueError(f"Unknown preset {preset}. Options: {', '.join(QUALITY_PRESETS)}")
+        return preset
+
+    @field_validator("duration")
+    @classmethod
+    def check_duration(cls, duration):
+        if duration is not None and not 0 < duration <= LOOP_MAX_DURATION_SECONDS:
+            raise ValueError(f"duration must be between 0 and {LOOP_MAX_DURATION_SECONDS:.0f} seconds")
+        return duration
 
 class AmbienceResponse(BaseModel):
     success: bool
     message: str
     result: Optional[str] = None
 
+class JobSubmitted(BaseModel):
+    job_id: str
+    status: str
+
+# The request bodies are parsed by hand (JSON or multipart), so they are declared for the OpenAPI docs here
+_AMBIENCE_REQUEST_SCHEMA = AmbienceRequest.model_json_schema()
+AMBIENCE_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": _AMBIENCE_REQUEST_SCHEMA},
+            "multipart/form-data": {"schema": {
+                **_AMBIENCE_REQUEST_SCHEMA,
+                "properties": {
+                    **_AMBIENCE_REQUEST_SCHEMA["properties"],
+                    "image": {"type": "string", "format": "binary", "description": "Image uploaded in place of img_url"},
+                },
+            }},
+        },
+    }
+}
+
+# Room for the text fields and multipart framing next to the image
+FORM_OVERHEAD_BYTES = 64 * 1024
+
+async def read_limited_body(http_request: Request, limit: int) -> bytes:
+    """Read the request body into memory, answering 413 as soon as it is known to exceed limit"""
+    length = http_request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > limit:
+        raise HTTPException(status_code=413, detail=f"Request body is larger than {limit} bytes")
+    body = bytearray()
+    async for chunk in http_request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise HTTPException(status_code=413, detail=f"Request body is larger than {limit} bytes")
+    return bytes(body)
+
+def parse_form(content_type: str, body: bytes) -> dict:
+    """Parse a multipart/form-data body in memory: field name -> str, or bytes for uploaded files.
+
+    Starlette's form parser spools files over 1 MB to temporary files, so uploads are parsed here instead.
+    """
+    message = BytesParser(policy=email.policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body
+    )
+    if not message.is_multipart():
+        raise HTTPException(status_code=400, detail="Malformed multipart body")
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        if name is None:
+            continue
+        payload = part.get_payload(decode=True) or b""
+        fields[name] = payload if part.get_filename() is not None else payload.decode(part.get_content_charset() or "utf-8")
+    return fields
+
+async def upload_image(data: bytes) -> str:
+    """Downscale and store an uploaded image, returning its upload:// reference"""
+    if len(data) > IMAGE_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image is larger than {IMAGE_MAX_BYTES} bytes")
+    try:
+        return await asyncio.to_thread(store_upload, data)
+    except ImageFetchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def read_ambience_request(http_request: Request) -> AmbienceRequest:
+    """Parse a JSON body, or a multipart form with the image uploaded inline as its "image" file.
+
+    Forms are read and parsed in memory, and refused before buffering once they exceed the image limit.
+    """
+    content_type = http_request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        body = await read_limited_body(http_request, IMAGE_MAX_BYTES + FORM_OVERHEAD_BYTES)
+        form = await asyncio.to_thread(parse_form, content_type, body)
+        img_url = form.get("img_url") or "no image provided"
+        image = form.get("image")
+        if isinstance(image, bytes) and image:
+            img_url = await upload_image(image)
+        try:
+            return AmbienceRequest(
+                query=form.get("query") or "",
+                img_url=img_url,
+                user_feedback=form.get("user_feedback") or "",
+                preset=form.get("preset") or None,
+                progressive=form.get("progressive") or False,
+                seed=form.get("seed") or None,
+                duration=form.get("duration") or None,
+            )
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    try:
+        return AmbienceRequest.model_validate(await http_request.json())
+    except (ValueError, ValidationError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize the system once on startup"""
     global main_graph
     print("Initializing Intelligent Ambience System...")
     main_graph = MainGraph()
-    print("System ready!")
+    job_manager.main_graph = main_graph
+    # Load eager models in the background so the server can answer health checks straight away
+    model_registry.start_warm_up()
+    # Pick up jobs that were queued or running when the previous worker stopped
+    job_manager.recover()
+    # Drop expired artifacts and job directories a crashed worker left behind
+    print(f"Artifact GC: {artifact_store.gc()}")
+    print("System ready! Warming up models in the background, see /ready")
+
+@app.post("/generate", response_model=AmbienceResponse, openapi_extra=AMBIENCE_REQUEST_BODY)
+async def generate_ambience(http_request: Request):
+    """Generate ambient music based on location and context.
 
-@app.post("/generate", response_model=AmbienceResponse)
-async def generate_ambience(request: AmbienceRequest):
-    """Generate ambient music based on location and context"""
+    Accepts a JSON AmbienceRequest, or a multipart form (query, user_feedback, image file).
+    """
+    request = await read_ambience_request(http_request)
     try:
         if not main_graph:
             raise HTTPException(status_code=500, detail="System not initialized")
         
-        # Run the system (this will be synchronous, but we can make it async)
-        result = await asyncio.to_thread(
-            main_graph.run_with_feedback_streaming,
-            request.query,
-            request.img_url,
-            request.user_feedback
-        )
+        # Runs as a job so the scheduler bounds concurrent work; this endpoint just waits for it
+        job_id = job_manager.submit(request.model_dump())
+        job = await job_manager.wait(job_id)
+        if job["status"] != SUCCEEDED:
+            raise RuntimeError(job["error"] or f"job {job['status']}")
         
         return AmbienceResponse(
             success=True,
             message="Ambient music generated successfully",
-            result=str(result)
+            result=job["result"]["summary"]
         )
         
+    except SchedulerBusy as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating ambience: {str(e)}")
 
+@app.post("/jobs", response_model=JobSubmitted, status_code=202, openapi_extra=AMBIENCE_REQUEST_BODY)
+async def create_job(http_request: Request):
+    """Queue a generation job and return its id immediately; accepts the same bodies as /generate"""
+    request = await read_ambience_request(http_request)
+    if not main_graph:
+        raise HTTPException(status_code=500, detail="System not initialized")
+    try:
+        job_id = job_manager.submit(request.model_dump())
+    except SchedulerBusy as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    return JobSubmitted(job_id=job_id, status=job_store.get_job(job_id)["status"])
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get a job's status and, once finished, its result or error"""
+    job = job_store.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def get_job_events(job_id: str, after: int = 0):
+    """Replay a job's event log, optionally only events after a sequence number"""
+    if job_store.get_job(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    await job_manager.flush_events()
+    return {"job_id": job_id, "events": job_store.get_events(job_id, after)}
+
+def job_artifact(job_id: str):
+    """Content hash and path of a job's mix, raising the HTTP error if there is none yet"""
+    job = job_store.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == SUCCEEDED:
+        content_hash = (job["result"] or {}).get("artifact")
+    else:
+        # The mix is announced while the job is still running, before its result is stored
+        content_hash = job_manager.running_artifact(job_id)
+    if not content_hash:
+        raise HTTPException(status_code=409, detail="Job has not produced an artifact")
+    path = artifact_store.path(content_hash)
+    if path is None:
+        raise HTTPException(status_code=410, detail="Artifact has expired")
+    return content_hash, path
+
+@app.get("/jobs/{job_id}/artifact")
+async def get_job_artifact(job_id: str):
+    """Download a finished job's mix"""
+    content_hash, path = job_artifact(job_id)
+    return FileResponse(
+        path,
+        media_type="audio/wav",
+        filename=f"{job_id}.wav",
+        # The content is addressed by its hash, so it never changes for this job
+        headers={"ETag": f'"{content_hash}"', "Cache-Control": "private, max-age=31536000, immutable"},
+    )
+
+@app.get("/jobs/{job_id}/audio")
+async def get_job_audio(job_id: str, http_request: Request, format: Optional[str] = None):
+    """Stream a finished job's mix as Opus, MP3, FLAC or WAV, chosen by format or the Accept header.
+
+    The first request for Opus streams it while it is being encoded; other
+    formats wait for their encoding. Complete encodings are cached and served
+    with single byte-range support.
+    """
+    content_hash, path = job_artifact(job_id)
+    name = format or negotiate(http_request.headers.get("accept", ""))
+    if name not in AUDIO_FORMATS:
+        raise HTTPException(
+            status_code=406 if format is None else 400,
+            detail=f"Available formats: {', '.join(AUDIO_FORMATS)}",
+        )
+    encoding = await asyncio.to_thread(audio_encoder.open, content_hash, path, name)
+    media_type = AUDIO_FORMATS[name][0]
+    headers = {"Vary": "Accept", "Cache-Control": "private, max-age=31536000, immutable"}
+
+    if not encoding.done.is_set() and name in STREAMABLE_WHILE_ENCODING:
+        try:
+            # Length unknown until encoding finishes, so this is sent chunked and not cached by the client
+            return StreamingResponse(
+                iter_file(encoding.partial_path, done=encoding.done),
+                media_type=media_type,
+                headers={"Vary": "Accept", "Cache-Control": "no-store"},
+            )
+        except FileNotFoundError:
+            # Finished between the check and opening the partial file
+            pass
+    # MP3 and FLAC headers are rewritten when encoding finishes, so they are only sent complete
+    await asyncio.to_thread(encoding.done.wait)
+    if encoding.error:
+        raise HTTPException(status_code=500, detail=f"Could not encode the mix as {name}: {encoding.error}")
+
+    size = os.path.getsize(encoding.path)
+    headers.update({"Accept-Ranges": "bytes", "ETag": f'"{content_hash}-{name}"'})
+    try:
+        byte_range = parse_range(http_request.headers.get("range"), size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if byte_range is None:
+        return StreamingResponse(
+            iter_file(encoding.path), media_type=media_type, headers={**headers, "Content-Length": str(size)}
+        )
+    start, end = byte_range
+    return StreamingResponse(
+        iter_file(encoding.path, start, end),
+        status_code=206,
+        media_type=media_type,
+        headers={**headers, "Content-Length": str(end - start), "Content-Range": f"bytes {start}-{end - 1}/{size}"},
+    )
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job"""
+    if job_store.get_job(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not job_manager.cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job is not queued or running")
+    return {"job_id": job_id, "status": "cancelling"}
+
 #this is a generate websocket connection that connects only whilst the system is generating and streams the system 'thinking'.
 @app.websocket("/ws/generate")
 async def ws_generate(websocket:WebSocket):
     await websocket.accept() #this awaits for a connection to the front-end? I think
-    task = None
+    job_id = None
+    reader_task = None
     queue: asyncio.Queue = asyncio.Queue()
     
     try: 
@@ -78,91 +345,40 @@ async def ws_generate(websocket:WebSocket):
             return
     
         #get the messages from init
-        query = init_msg.get("query") or ""
-        img_url = init_msg.get("img_url") or "no image provided"
-
-        await queue.put({"type":"status","message":"Starting..."})
-
-        async def run_graph():
+        try:
+            request = AmbienceRequest(
+                query=init_msg.get("query") or "",
+                img_url=init_msg.get("img_url") or "no image provided",
+                preset=init_msg.get("preset"),
+                progressive=init_msg.get("progressive") or False,
+                seed=init_msg.get("seed"),
+                duration=init_msg.get("duration"),
+            )
+        except ValidationError as e:
+            await websocket.send_json({"type":"error","message":str(e)})
+            await websocket.close()
+            return
 
+        # With has_image the next frame is the image itself, sent as binary
+        if init_msg.get("has_image"):
             try:
-                loop = asyncio.get_running_loop()
-                def map_chunk_to_events(chunk):
-                    events = []
-
-                    def emit(name: str, content):
-                        # Accept string or list parts with text
-                        if isinstance(content, str) and content.strip():
-                            events.append({"type": "token", "text": f"{name}: {content}\n"})
-                        elif isinstance(content, list):
-                            for part in content:
-                                if isinstance(part, dict) and part.get("type") == "text" and part.get("text"):
-                                    events.append({"type": "token", "text": f"{name}: {part['text']}\n"})
-
-                    def emit_filtered_from_messages(messages, prefix: str | None = None):
-                        for m in messages:
-                            mtype = type(m).__name__  # "AIMessage", "ToolMessage", etc.
-                            name = prefix or getattr(m, "name", None) or getattr(m, "role", None) or "agent"
-
-                            if mtype == "AIMessage":
-                                emit(name, getattr(m, "content", ""))
-
-                            elif mtype == "ToolMessage":
-                                emit(name, getattr(m, "content", ""))
-
-                    # 1) Top-level messages (if present)
-                    if isinstance(chunk.get("messages"), list):
-                        emit_filtered_from_messages(chunk["messages"])
-
-                    # 2) Node-keyed outputs: preserve node labels and only surface AI/Tool messages
-                    for node_key in (
-                        "supervisor",
-                        "global_context_agent",
-                        "local_context_agent",
-                        "memory_agent",
-                        "reinforcement_agent",
-                        "music_generation_agent",
-                    ):
-                        if node_key in chunk:
-                            node_val = chunk[node_key]
-                            # Common shape: dict with "messages": [...]
-                            if isinstance(node_val, dict) and isinstance(node_val.get("messages"), list):
-                                emit_filtered_from_messages(node_val["messages"], prefix=node_key)
-                            else:
-                                # Fallback: single message-like object with .content
-                                content = (
-                                    getattr(node_val, "content", None)
-                                    or (node_val.get("content") if isinstance(node_val, dict) else None)
-                                )
-                                if content:
-                                    emit(node_key, content)
-
-                    return events
-                
-                def produce():
-                    try:
-                        inputs = {"messages": [("user", f"{query} {img_url}")]}
-                        print("produce: starting")
-                        for chunk in main_graph.graph.stream(inputs):
-                            if chunk is None:
-                                print("produce: got None chunk"); continue
-                            print("produce: chunk keys", list(chunk.keys()))
-
-                            for evt in map_chunk_to_events(chunk):
-                                print("produce: enqueue", evt)
-                                loop.call_soon_threadsafe(queue.put_nowait, evt)
-                        print("produce: done enqueueing")
-                        loop.call_soon_threadsafe(queue.put_nowait, {"type":"done","summary":"ok"})
-                    except Exception as e:
-                        loop.call_soon_threadsafe(queue.put_nowait, {"type":"error","message":str(e)})
-                
-                await asyncio.to_thread(produce)
-            except Exception as e:
-                print("run_graph error:", e)
-                await queue.put({"type":"error","message":str(e)})
-        
+                request.img_url = await upload_image(await websocket.receive_bytes())
+            except (HTTPException, KeyError) as e:
+                detail = e.detail if isinstance(e, HTTPException) else "Expected image bytes"
+                await websocket.send_json({"type":"error","message":detail})
+                await websocket.close()
+                return
 
-        task = asyncio.create_task(run_graph())
+        await websocket.send_json({"type":"status","message":"Starting..."})
+
+        # Admit the job (or queue it); events, including queue position, arrive on the queue
+        try:
+            job_id = job_manager.submit(request.model_dump(), listener=queue)
+        except SchedulerBusy as e:
+            await websocket.send_json({"type":"busy","message":str(e)})
+            await websocket.close(code=1013)
+            return
+        await websocket.send_json({"type":"job","job_id":job_id})
 
         #optional: read client messages e.g 'cancel'. Will need to add user feedback here? 
         async def read_client():
@@ -170,8 +386,7 @@ async def ws_generate(websocket:WebSocket):
                 try: 
                     msg = await websocket.receive_json()
                     if msg.get("type") == "cancel":
-                        if task:
-                            task.cancel()
+                        job_manager.cancel(job_id)
 
                 except Exception:
                     break
@@ -181,25 +396,71 @@ async def ws_generate(websocket:WebSocket):
         #send events
         while True:
             event = await queue.get()
+            if event.get("audio") is not None:
+                # Finished stems are pushed as a JSON header followed by one binary frame of encoded audio
+                data = await asyncio.to_thread(encode_audio, event["audio"], event["sample_rate"], STEM_STREAM_FORMAT)
+                header = {key: value for key, value in event.items() if key not in LIVE_ONLY_FIELDS}
+                await websocket.send_json({
+                    **header,
+                    "format": STEM_STREAM_FORMAT,
+                    "media_type": AUDIO_FORMATS[STEM_STREAM_FORMAT][0],
+                    "bytes": len(data),
+                })
+                await websocket.send_bytes(data)
+                continue
             await websocket.send_json(event)
-            if event.get("type") in ("error","done"):
+            if event.get("type") in TERMINAL_EVENTS:
                 break
 
-
     except WebSocketDisconnect:
-        if task:
-            task.cancel()
+        pass
 
     finally:
-        if task:
-            task.cancel()
+        if reader_task:
+            reader_task.cancel()
+        # A client that goes away no longer wants the result
+        if job_id:
+            job_manager.cancel(job_id)
 
 
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "system": "intelligent-ambience"}
+    return {"status": "healthy", "system": "intelligent-ambience", "scheduler": job_scheduler.stats()}
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness endpoint: 200 once every eager model has loaded, 503 until then"""
+    ready = main_graph is not None and model_registry.ready()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "models": model_registry.status()},
+    )
+
+@app.get("/metrics")
+async def get_metrics():
+    """Counters and timings collected in this process"""
+    llm_cache = get_llm_cache()
+    return {
+        **metrics.snapshot(),
+        "scheduler": job_scheduler.stats(),
+        "llm_cache": llm_cache.stats() if llm_cache else None,
+        "search_cache": search_cache.stats(),
+        "global_context_cache": global_context_cache.stats(),
+        "artifacts": artifact_store.stats(),
+        "prompt_embedding_cache": (
+            get_stable_audio().prompt_embeddings.stats() if model_registry.is_loaded("stable_audio") else None
+        ),
+        "diffusion": (
+            get_stable_audio().diffusion_monitor.stats() if model_registry.is_loaded("stable_audio") else None
+        ),
+        "stem_library": (
+            get_stable_audio().stem_library.stats()
+            if model_registry.is_loaded("stable_audio") and get_stable_audio().stem_library is not None
+            else None
+        ),
+    }
 
 @app.get("/")
 async def root():
@@ -208,7 +469,15 @@ async def root():
         "message": "Intelligent Ambience API",
         "endpoints": {
             "POST /generate": "Generate ambient music",
+            "POST /jobs": "Queue a generation job",
+            "GET /jobs/{id}": "Job status and result",
+            "GET /jobs/{id}/events": "Replay a job's events",
+            "GET /jobs/{id}/artifact": "Download a finished job's mix",
+            "GET /jobs/{id}/audio": "Stream a job's mix as Opus, MP3, FLAC or WAV (Accept or ?format=), with Range support",
+            "POST /jobs/{id}/cancel": "Cancel a job",
             "GET /health": "Health check",
+            "GET /ready": "Readiness and per-model load state",
+            "GET /metrics": "Cache, scheduler and timing metrics",
             "GET /": "This info"
         }
     }
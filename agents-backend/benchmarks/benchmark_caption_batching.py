@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark captioning throughput with and without cross-request micro-batching
+Simulates concurrent jobs, each captioning its own image session, and reports
+captions per second and mean latency at each concurrency level. "unbatched"
+serializes calls on the GPU as the captioner resource limit does.
+
+Usage: python benchmarks/benchmark_caption_batching.py --concurrency 1 2 4 8 16 --max-wait-ms 10
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.caption_batcher import CaptionBatcher
+from tools.local_context_tools import ImageCaptioning, ImageSession
+
+
+def run_level(caption, image, concurrency: int, requests_per_worker: int, prompt: str):
+    latencies = []
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(requests_per_worker):
+            # A fresh session per request, so the vision encoder runs every time
+            session = ImageSession(None, image)
+            start = time.perf_counter()
+            caption(session, [prompt])
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return len(latencies) / elapsed, statistics.mean(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare caption throughput with and without micro-batching")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 2, 4, 8, 16])
+    parser.add_argument("--requests", type=int, default=4, help="Captions per concurrent worker")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=10)
+    parser.add_argument("--device", default="auto", choices=("auto", "cuda", "cpu"))
+    parser.add_argument("--img-url", default="https://farm5.staticflickr.com/4888/45890544791_0a419c887b_c.jpg")
+    parser.add_argument("--prompt", default="An image of")
+    args = parser.parse_args()
+
+    captioner = ImageCaptioning(device=args.device)
+    image = captioner.convert_raw_image(args.img_url)
+    batcher = CaptionBatcher(lambda: captioner, args.max_batch_size, args.max_wait_ms)
+    gpu_lock = threading.Lock()
+
+    def unbatched(session, prompts):
+        with gpu_lock:
+            return captioner.caption_session(session, prompts)
+
+    # Warm up both paths
+    unbatched(ImageSession(None, image), [args.prompt])
+    batcher.caption(ImageSession(None, image), [args.prompt])
+
+    print("| concurrency | mode | captions/s | mean latency (ms) |")
+    print("|-------------|------|------------|-------------------|")
+    for concurrency in args.concurrency:
+        for mode, caption in (("unbatched", unbatched), ("batched", batcher.caption)):
+            throughput, latency = run_level(caption, image, concurrency, args.requests, args.prompt)
+            print(f"| {concurrency} | {mode} | {throughput:.2f} | {latency * 1000:.0f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Benchmark caption latency of the captioner backends
+Loads the BLIP captioner with each backend and reports the time per caption,
+including the vision encoder (every caption uses a fresh image session).
+
+Usage: python benchmarks/benchmark_captioner.py --backends torch int8 onnx --device cpu
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.captioner_backends import CAPTION_BACKENDS
+from tools.local_context_tools import ImageCaptioning
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare caption latency of the captioner backends")
+    parser.add_argument("--runs", type=int, default=10, help="Captions per backend")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed captions before measuring")
+    parser.add_argument("--device", default="auto", choices=("auto", "cuda", "cpu"))
+    parser.add_argument("--backends", nargs="+", default=list(CAPTION_BACKENDS), choices=CAPTION_BACKENDS)
+    parser.add_argument("--img-url", default="https://farm5.staticflickr.com/4888/45890544791_0a419c887b_c.jpg")
+    parser.add_argument("--prompt", default="An image of")
+    args = parser.parse_args()
+
+    results = {}
+    for backend in args.backends:
+        start = time.perf_counter()
+        captioner = ImageCaptioning(device=args.device, backend=backend)
+        load_time = time.perf_counter() - start
+        image = captioner.convert_raw_image(args.img_url)
+
+        for _ in range(args.warmup):
+            captioner.conditional_image_captioning(args.prompt, image)
+        timings = []
+        for i in range(args.runs):
+            start = time.perf_counter()
+            caption = captioner.conditional_image_captioning(args.prompt, image)
+            timings.append(time.perf_counter() - start)
+            if i == 0:
+                print(f"{backend}: {caption}")
+        results[backend] = (captioner.device, load_time, timings)
+        del captioner
+
+    print()
+    print("| backend | device | load (s) | mean (ms) | median (ms) | p95 (ms) |")
+    print("|---------|--------|----------|-----------|-------------|----------|")
+    for backend, (device, load_time, timings) in results.items():
+        p95 = sorted(timings)[max(0, int(len(timings) * 0.95) - 1)]
+        print(
+            f"| {backend} | {device} | {load_time:.1f} | {statistics.mean(timings) * 1000:.0f} | "
+            f"{statistics.median(timings) * 1000:.0f} | {p95 * 1000:.0f} |"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Benchmark end-to-end latency of the MainGraph modes
+Runs the same request through each mode and reports wall-clock time and the
+number of LLM calls made per run. The LLM response cache and the search and
+global context caches are disabled, so every run does the full work of its
+mode; pass --with-caches to measure warm runs against the configured caches.
+
+Usage: python benchmarks/benchmark_graph_modes.py --runs 3
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+class LLMCallCounter(BaseCallbackHandler):
+    """Counts chat model calls made during a run"""
+
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        with self._lock:
+            self.calls += 1
+
+
+def run_once(main_graph: MainGraph, query: str, img_url: str):
+    counter = LLMCallCounter()
+    config = main_graph.run_config()
+    config["callbacks"] = config["callbacks"] + [counter]
+    start = time.perf_counter()
+    main_graph.graph.invoke(main_graph.build_inputs(query, img_url), config=config)
+    return time.perf_counter() - start, counter.calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare end-to-end latency of the graph modes")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per mode")
+    parser.add_argument("--query", default="Sarajevo, Bosnia and Herzegovina")
+    parser.add_argument("--img-url", default="https://farm5.staticflickr.com/4888/45890544791_0a419c887b_c.jpg")
+    parser.add_argument("--modes", nargs="+", help="Modes to compare, default all")
+    parser.add_argument("--with-caches", action="store_true", help="Keep the LLM, search and global context caches")
+    args = parser.parse_args()
+
+    # Read when the agents and tools are imported, so set before importing MainGraph
+    if not args.with_caches:
+        os.environ["LLM_CACHE_ENABLED"] = "false"
+        os.environ["CACHE_BACKEND"] = "none"
+    from main_graph import MainGraph, GRAPH_MODES
+    modes = args.modes or list(GRAPH_MODES)
+    for mode in modes:
+        if mode not in GRAPH_MODES:
+            parser.error(f"Unknown mode {mode}. Options: {', '.join(GRAPH_MODES)}")
+
+    results = {}
+    for mode in modes:
+        main_graph = MainGraph(mode=mode)
+        timings, calls = [], []
+        for i in range(args.runs):
+            elapsed, llm_calls = run_once(main_graph, args.query, args.img_url)
+            print(f"{mode} run {i + 1}/{args.runs}: {elapsed:.1f}s, {llm_calls} LLM calls")
+            timings.append(elapsed)
+            calls.append(llm_calls)
+        results[mode] = (timings, calls)
+
+    print()
+    print("| mode | runs | mean (s) | median (s) | max (s) | LLM calls/run |")
+    print("|------|------|----------|------------|---------|---------------|")
+    for mode, (timings, calls) in results.items():
+        print(
+            f"| {mode} | {len(timings)} | {statistics.mean(timings):.1f} | "
+            f"{statistics.median(timings):.1f} | {max(timings):.1f} | {statistics.mean(calls):.1f} |"
+        )
+
+
+if __name__ == "__main__":
+    main()
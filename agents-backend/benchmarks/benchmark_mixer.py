@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark the NumPy mixer against the previous pydub overlay path
+Writes synthetic stems of different lengths to a temporary directory, then
+times reading, mixing and writing them with each implementation.
+
+Usage: python benchmarks/benchmark_mixer.py --stems 4 --seconds 15 --runs 5
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import soundfile as sf
+from pydub import AudioSegment
+from tools.audio_mixer import mix_files
+
+
+def pydub_overlay(paths: list, output_path: str):
+    # The overlay_audio_files implementation this mixer replaced
+    audio_files = [AudioSegment.from_file(path) for path in paths]
+    combined_audio = audio_files[0]
+    for audio_file in audio_files[1:]:
+        combined_audio = combined_audio.overlay(audio_file)
+    combined_audio.export(output_path, format="wav")
+
+
+def write_stems(directory: str, count: int, seconds: float, sample_rate: int) -> list:
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        # Stems get shorter so the length handling is exercised too
+        samples = int(seconds * sample_rate * (1 - 0.1 * i))
+        t = np.arange(samples) / sample_rate
+        tone = 0.3 * np.sin(2 * np.pi * 110 * (i + 1) * t)[:, None] + 0.05 * rng.standard_normal((samples, 2))
+        path = os.path.join(directory, f"stem_{i}.wav")
+        sf.write(path, tone.astype(np.float32), sample_rate)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the NumPy mixer with pydub overlay")
+    parser.add_argument("--stems", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--sample-rate", type=int, default=44100)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_stems(directory, args.stems, args.seconds, args.sample_rate)
+        output_path = os.path.join(directory, "mix.wav")
+        results = {}
+        for name, run in (
+            ("pydub overlay", lambda: pydub_overlay(paths, output_path)),
+            ("numpy mix (peak)", lambda: mix_files(paths, output_path, normalization="peak")),
+            ("numpy mix (lufs)", lambda: mix_files(paths, output_path, normalization="lufs")),
+        ):
+            timings = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - start)
+            results[name] = (timings, sf.info(output_path).duration)
+
+    print(f"{args.stems} stems, up to {args.seconds:.0f}s at {args.sample_rate} Hz")
+    print()
+    print("| implementation | mean (ms) | median (ms) | output length (s) |")
+    print("|----------------|-----------|-------------|-------------------|")
+    for name, (timings, duration) in results.items():
+        print(f"| {name} | {statistics.mean(timings) * 1000:.1f} | {statistics.median(timings) * 1000:.1f} | {duration:.2f} |")
+
+
+if __name__ == "__main__":
+    main()
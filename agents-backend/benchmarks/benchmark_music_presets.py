@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Benchmark StableAudio latency per quality preset
+Renders the same prompt with each preset (and optionally custom step counts)
+and reports wall-clock latency and the real-time factor. Run it once per
+device to compare CPU and GPU.
+
+Usage: python benchmarks/benchmark_music_presets.py --device cuda --steps 4 8 25
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.music_generation_tools import QUALITY_PRESETS, StableAudioSmall
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare StableAudio latency across presets and step counts")
+    parser.add_argument("--device", default=None, choices=("cuda", "cpu"), help="Defaults to cuda when available")
+    parser.add_argument("--presets", nargs="+", default=list(QUALITY_PRESETS), choices=list(QUALITY_PRESETS))
+    parser.add_argument("--steps", nargs="*", type=int, default=[], help="Extra step counts run with the standard scheduler")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument("--prompt", default="Warm ambient pad with soft rain")
+    args = parser.parse_args()
+
+    model = StableAudioSmall(device=args.device)
+    model._load_pipeline()
+
+    configs = [(preset, QUALITY_PRESETS[preset]["steps"]) for preset in args.presets]
+    for steps in args.steps:
+        name = f"standard@{steps}"
+        QUALITY_PRESETS[name] = {**QUALITY_PRESETS["standard"], "steps": steps}
+        configs.append((name, steps))
+
+    # One untimed render to load kernels and allocate memory
+    model._render([args.prompt], args.duration, "draft")
+
+    results = []
+    for preset, steps in configs:
+        duration = min(args.duration, QUALITY_PRESETS[preset]["max_duration"])
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            model._render([args.prompt], duration, preset)
+            timings.append(time.perf_counter() - start)
+        results.append((preset, steps, duration, statistics.mean(timings)))
+        print(f"{preset}: {statistics.mean(timings):.1f}s")
+
+    print()
+    print("| preset | steps | device | audio (s) | latency (s) | real-time factor |")
+    print("|--------|-------|--------|-----------|-------------|------------------|")
+    for preset, steps, duration, latency in results:
+        print(f"| {preset} | {steps} | {model.device} | {duration:.0f} | {latency:.1f} | {duration / latency:.2f}x |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Per-job context shared by the graph, agents and tools
+
+The JobContext of the job being executed is held in a context variable, which
+LangGraph and LangChain copy into the worker threads they run nodes and tools
+on, so tools can reach it without it being threaded through every signature.
+"""
+
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once it has been cancelled"""
+
+
+class CancellationToken:
+    """Thread-safe flag checked cooperatively by long-running work"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise JobCancelled("Job cancelled")
+
+
+@dataclass
+class JobContext:
+    job_id: str
+    cancel_token: CancellationToken = field(default_factory=CancellationToken)
+    # Publishes an event to the job's clients; safe to call from worker threads
+    emit: Optional[Callable[[dict], None]] = None
+    # Music generation options chosen with the request
+    preset: Optional[str] = None
+    progressive: bool = False
+    seed: Optional[int] = None
+    # Length of the final mix in seconds; stems are looped to reach it
+    duration: Optional[float] = None
+    # Audio stems handed between the music tools (a StemStore, created on first use)
+    stems: Any = None
+    # The job's own output directory, created on first use
+    output_dir: Optional[str] = None
+    # Content hash of the job's final mix in the artifact store
+    artifact: Optional[str] = None
+
+
+_current_job: ContextVar = ContextVar("current_job", default=None)
+
+
+def current_job():
+    """Return the JobContext of the running job, or None outside a job"""
+    return _current_job.get()
+
+
+@contextmanager
+def job_scope(context: JobContext):
+    """Make context the current job for the duration of the block"""
+    token = _current_job.set(context)
+    try:
+        yield context
+    finally:
+        _current_job.reset(token)
+
+
+def check_cancelled():
+    """Raise JobCancelled if the current job has been cancelled"""
+    context = _current_job.get()
+    if context is not None:
+        context.cancel_token.raise_if_cancelled()
+
+
+def handle_tool_error(e: Exception) -> str:
+    """ToolNode error handler: report a failed tool call to the model, but let JobCancelled end the job"""
+    if isinstance(e, JobCancelled):
+        raise e
+    return f"Error: {e!r}\n Please fix your mistakes."
+
+
+def emit_event(event: dict):
+    """Publish an event to the current job's clients; does nothing outside a job"""
+    context = _current_job.get()
+    if context is not None and context.emit is not None:
+        context.emit(event)
+
+
+class CancellationHandler(BaseCallbackHandler):
+    """Stops a cancelled job before its next LLM call or tool call.
+
+    Must come before any handler that acquires resources on start, since a
+    raising handler prevents the ones after it from running.
+    """
+
+    raise_error = True
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        check_cancelled()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        check_cancelled()
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        check_cancelled()
+
+
+cancellation_handler = CancellationHandler()
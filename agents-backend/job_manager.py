@@ -0,0 +1,228 @@
+"""
+Runs generation jobs in the background
+
+JobManager admits jobs through the scheduler, runs them through MainGraph on
+a worker thread, records status and events in the JobStore and forwards
+events to any live listeners (e.g. a WebSocket). Events are forwarded on the
+event loop and written to the store in batches by a writer thread, so disk
+writes never hold up other clients.
+"""
+
+import asyncio
+import contextlib
+import queue
+import shutil
+import threading
+import uuid
+
+from job_store import JobStore, QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED, FINISHED_STATUSES
+from job_context import JobContext, JobCancelled, job_scope
+from scheduler import JobScheduler, SchedulerBusy
+from tools.image_fetch import UPLOAD_SCHEME, upload_store
+
+# Events after which a job produces no more output
+TERMINAL_EVENTS = ("done", "error", "cancelled")
+# Event fields only passed to live listeners, e.g. audio arrays, never written to the event log
+LIVE_ONLY_FIELDS = ("audio",)
+# Frequent events with no replay value, only passed to live listeners
+LIVE_ONLY_EVENTS = ("progress", "queue")
+
+
+class JobManager:
+    def __init__(self, store: JobStore, scheduler: JobScheduler):
+        self.store = store
+        self.scheduler = scheduler
+        self.main_graph = None
+        self._tasks = {}
+        self._contexts = {}
+        self._listeners = {}
+        # (job_id, event) pairs waiting to be written, or threading.Events set once everything before them is
+        self._event_log = queue.Queue()
+        threading.Thread(target=self._write_events, daemon=True).start()
+
+    def submit(self, request: dict, listener: asyncio.Queue = None) -> str:
+        """Admit and start a job, returning its id.
+
+        Raises SchedulerBusy when the wait queue is full. If listener is given
+        it receives every event of the job, starting with its queue position.
+        """
+        job_id = uuid.uuid4().hex
+        ticket = self.scheduler.admit(on_position=self._position_callback(job_id))
+        self.store.create_job(request, job_id)
+        if listener is not None:
+            self._listeners.setdefault(job_id, []).append(listener)
+        self._start(job_id, request, ticket)
+        return job_id
+
+    def recover(self):
+        """Resume jobs left queued or running by a previous worker"""
+        for job in self.store.unfinished_jobs():
+            job_id = job["job_id"]
+            img_url = job["request"].get("img_url") or ""
+            if img_url.startswith(UPLOAD_SCHEME) and not upload_store.exists(img_url):
+                self.store.set_status(job_id, FAILED, error=f"Could not resume after restart: uploaded image {img_url} is gone")
+                self._publish(job_id, {"type": "error", "message": "Could not resume after restart: uploaded image is gone"})
+                continue
+            try:
+                ticket = self.scheduler.admit(on_position=self._position_callback(job_id))
+            except SchedulerBusy as e:
+                self.store.set_status(job_id, FAILED, error=f"Could not resume after restart: {e}")
+                self._publish(job_id, {"type": "error", "message": "Could not resume after restart"})
+                # Its disk copy was only kept for this job
+                upload_store.release(img_url)
+                continue
+            self.store.set_status(job_id, QUEUED)
+            self._publish(job_id, {"type": "status", "message": "Resumed after worker restart"})
+            self._start(job_id, job["request"], ticket)
+            print(f"Resumed job {job_id}")
+
+    def running_artifact(self, job_id: str):
+        """Content hash of the mix a running job has already stored, if any"""
+        context = self._contexts.get(job_id)
+        return context.artifact if context is not None else None
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job. Returns False if it is not queued or running.
+
+        A running job is stopped cooperatively so its scheduler slot is only
+        freed once the worker thread has actually let go of the GPU.
+        """
+        context = self._contexts.get(job_id)
+        if context is not None:
+            context.cancel_token.cancel()
+            return True
+        task = self._tasks.get(job_id)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    async def wait(self, job_id: str) -> dict:
+        """Wait for a job to finish and return its stored record"""
+        task = self._tasks.get(job_id)
+        if task is not None:
+            try:
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                # Only swallow the job's own cancellation, not the caller's
+                if not task.cancelled():
+                    raise
+        return self.store.get_job(job_id)
+
+    def _position_callback(self, job_id: str):
+        # Deferred so the job row exists before its first event is recorded
+        loop = asyncio.get_running_loop()
+        return lambda position: loop.call_soon(
+            self._publish, job_id, {"type": "queue", "position": position}
+        )
+
+    def _start(self, job_id: str, request: dict, ticket):
+        # An uploaded image stays on disk until the job ends, in case it has to be resumed
+        upload_store.hold(request.get("img_url") or "")
+        task = asyncio.create_task(self._run(job_id, request, ticket))
+        # The coroutine never runs if it is cancelled before starting, so clean up here too
+        task.add_done_callback(lambda _: self._finalize(job_id, request, ticket))
+        self._tasks[job_id] = task
+
+    async def _run(self, job_id: str, request: dict, ticket):
+        loop = asyncio.get_running_loop()
+
+        def publish(event: dict):
+            loop.call_soon_threadsafe(self._publish, job_id, event)
+
+        context = None
+        worker = None
+        try:
+            await ticket.wait()
+            context = JobContext(
+                job_id,
+                emit=publish,
+                preset=request.get("preset"),
+                progressive=bool(request.get("progressive")),
+                seed=request.get("seed"),
+                duration=request.get("duration"),
+            )
+            self._contexts[job_id] = context
+            self.store.set_status(job_id, RUNNING)
+            self._publish(job_id, {"type": "status", "message": "Generating..."})
+            worker = asyncio.ensure_future(asyncio.to_thread(self._execute, request, publish, context))
+            result = await asyncio.shield(worker)
+            self.store.set_status(job_id, SUCCEEDED, result=result)
+            self._publish(job_id, {"type": "done", **result})
+        except (asyncio.CancelledError, JobCancelled):
+            # Make sure the worker thread stops too if the task itself was cancelled
+            if context is not None:
+                context.cancel_token.cancel()
+            if worker is not None:
+                # The thread cannot be interrupted, so the slot is kept until it has stopped
+                with contextlib.suppress(Exception):
+                    await asyncio.shield(worker)
+            self.store.set_status(job_id, CANCELLED)
+            self._publish(job_id, {"type": "cancelled", "message": "Job cancelled"})
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self.store.set_status(job_id, FAILED, error=str(e))
+            self._publish(job_id, {"type": "error", "message": str(e)})
+
+    def _execute(self, request: dict, publish, context: JobContext) -> dict:
+        """Run the graph on a worker thread, forwarding events as they arrive"""
+        summary = ""
+        try:
+            with job_scope(context):
+                for event in self.main_graph.stream_events(
+                    request.get("query", ""),
+                    request.get("img_url") or "no image provided",
+                    request.get("user_feedback") or "",
+                ):
+                    if event.get("type") == "done":
+                        summary = event.get("summary", "")
+                    else:
+                        publish(event)
+        finally:
+            # Intermediate stems and files are only needed while the job runs
+            if context.stems is not None:
+                context.stems.close()
+            if context.output_dir is not None:
+                shutil.rmtree(context.output_dir, ignore_errors=True)
+        return {"summary": summary, "artifact": context.artifact}
+
+    def _finalize(self, job_id: str, request: dict, ticket):
+        ticket.release()
+        upload_store.release(request.get("img_url") or "")
+        self._tasks.pop(job_id, None)
+        self._contexts.pop(job_id, None)
+        job = self.store.get_job(job_id)
+        if job and job["status"] not in FINISHED_STATUSES:
+            self.store.set_status(job_id, CANCELLED)
+            self._publish(job_id, {"type": "cancelled", "message": "Job cancelled"})
+        self._listeners.pop(job_id, None)
+
+    async def flush_events(self):
+        """Wait until every event published so far has been written to the store"""
+        written = threading.Event()
+        self._event_log.put(written)
+        await asyncio.to_thread(written.wait)
+
+    def _publish(self, job_id: str, event: dict):
+        if event.get("type") not in LIVE_ONLY_EVENTS:
+            self._event_log.put((job_id, {key: value for key, value in event.items() if key not in LIVE_ONLY_FIELDS}))
+        for listener in self._listeners.get(job_id, []):
+            listener.put_nowait(event)
+
+    def _write_events(self):
+        while True:
+            batch = [self._event_log.get()]
+            while True:
+                try:
+                    batch.append(self._event_log.get_nowait())
+                except queue.Empty:
+                    break
+            entries = [item for item in batch if not isinstance(item, threading.Event)]
+            if entries:
+                try:
+                    self.store.append_events(entries)
+                except Exception as e:
+                    print(f"Writing {len(entries)} job events failed: {e}")
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
@@ -0,0 +1,141 @@
+"""
+Persistent job store backed by a local SQLite database
+
+Keeps each job's request, status, result and ordered event log so clients can
+poll for results and replay events, and so unfinished jobs can be resumed
+after a worker restart.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from dotenv import load_dotenv
+load_dotenv()
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.db")
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobStore:
+    def __init__(self, path: str = JOB_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    request TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )"""
+            )
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS job_events (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    event TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    PRIMARY KEY (job_id, seq)
+                )"""
+            )
+
+    def create_job(self, request: dict, job_id: str = None) -> str:
+        """Create a queued job and return its id"""
+        job_id = job_id or uuid.uuid4().hex
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, request, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(request), now, now),
+            )
+        return job_id
+
+    def get_job(self, job_id: str):
+        """Return the job as a dict, or None if it doesn't exist"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def set_status(self, job_id: str, status: str, result: dict = None, error: str = None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                (
+                    status,
+                    json.dumps(result) if result is not None else None,
+                    error,
+                    datetime.now().isoformat(),
+                    job_id,
+                ),
+            )
+
+    def append_event(self, job_id: str, event: dict) -> int:
+        """Append an event to the job's log and return its sequence number"""
+        return self.append_events([(job_id, event)])[0]
+
+    def append_events(self, entries: list) -> list:
+        """Append (job_id, event) pairs in order in one transaction and return their sequence numbers"""
+        now = datetime.now().isoformat()
+        seqs = []
+        last = {}  # job_id -> last sequence number
+        with self._lock, self._conn:
+            for job_id, event in entries:
+                if job_id not in last:
+                    last[job_id] = self._conn.execute(
+                        "SELECT COALESCE(MAX(seq), 0) FROM job_events WHERE job_id = ?", (job_id,)
+                    ).fetchone()[0]
+                last[job_id] += 1
+                seqs.append(last[job_id])
+            self._conn.executemany(
+                "INSERT INTO job_events (job_id, seq, event, created_at) VALUES (?, ?, ?, ?)",
+                [(job_id, seq, json.dumps(event), now) for (job_id, event), seq in zip(entries, seqs)],
+            )
+        return seqs
+
+    def get_events(self, job_id: str, after: int = 0) -> list:
+        """Return the job's events with a sequence number greater than after"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, event, created_at FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, after),
+            ).fetchall()
+        return [
+            {"seq": row["seq"], "created_at": row["created_at"], **json.loads(row["event"])}
+            for row in rows
+        ]
+
+    def unfinished_jobs(self) -> list:
+        """Jobs that were queued or running when the worker last stopped, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM jobs WHERE status NOT IN ({','.join('?' * len(FINISHED_STATUSES))}) ORDER BY created_at",
+                FINISHED_STATUSES,
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def _row_to_job(self, row) -> dict:
+        return {
+            "job_id": row["id"],
+            "status": row["status"],
+            "request": json.loads(row["request"]),
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
@@ -8,31 +8,224 @@ from agents.local_context_agent import LocalContextAgent
 from agents.music_generation_agent import MusicGenerationAgent
 from agents.memory_agent import MemoryAgent
 from agents.reinforcement_agent import ReinforcementAgent
+from scheduler import llm_slot_handler
+from job_context import cancellation_handler, check_cancelled
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import StateGraph, MessagesState, START, END
+from dotenv import load_dotenv
+load_dotenv()
+
+# "supervised": an LLM supervisor routes between agents via handoff tools
+# "pipeline": the agents run in a fixed order with no supervisor LLM calls
+# "parallel": like pipeline, but independent agents run concurrently
+GRAPH_MODES = ("supervised", "pipeline", "parallel")
+GRAPH_MODE = os.getenv("GRAPH_MODE", "supervised")
+
+# Instructions given to each agent in pipeline mode, replacing the supervisor's handoffs
+PIPELINE_INSTRUCTIONS = {
+    "global_context_agent": "Determine the emotional context of the location in the user's request.",
+    "local_context_agent": (
+        "Describe the user's environment using the image in the user's request. "
+        "If no image was provided, reply only \"no local context available\"."
+    ),
+    "memory_agent": "Retrieve user preferences and past music generations relevant to the context above.",
+    "reinforcement_agent": (
+        "Get learned music recommendations for the context and environment above. "
+        "If the user gave feedback, record it."
+    ),
+    "music_generation_agent": (
+        "Generate music for the user using the global context, local context, "
+        "memory data and reinforcement recommendations above."
+    ),
+    "memory_store": "Store the music generation that was just made, with its context and environment, in memory.",
+}
+
+# Stages of the parallel DAG: agents within a stage have no data dependency on
+# each other and run concurrently; each stage starts once the previous one has joined
+PARALLEL_STAGES = (
+    ("global_context_agent", "local_context_agent"),
+    ("memory_agent", "reinforcement_agent"),
+    ("music_generation_agent",),
+    ("memory_store",),
+)
+
+# Graph nodes whose outputs are surfaced to clients as "token" events
+AGENT_NODES = (
+    "supervisor",
+    "global_context_agent",
+    "local_context_agent",
+    "memory_agent",
+    "reinforcement_agent",
+    "music_generation_agent",
+    "memory_store",
+)
+
+# Nodes whose final message describes the generated music to the user
+SUMMARY_NODES = ("supervisor", "music_generation_agent")
+
+def chunk_to_events(chunk: dict) -> list:
+    """Map a LangGraph stream chunk to client events, surfacing only AI/Tool messages"""
+    events = []
+
+    def emit(name: str, content):
+        # Accept string or list parts with text
+        if isinstance(content, str) and content.strip():
+            events.append({"type": "token", "text": f"{name}: {content}\n"})
+        elif isinstance(content, list):
+            for part in content:
+                if isinstance(part, dict) and part.get("type") == "text" and part.get("text"):
+                    events.append({"type": "token", "text": f"{name}: {part['text']}\n"})
+
+    def emit_filtered_from_messages(messages, prefix: str | None = None):
+        for m in messages:
+            mtype = type(m).__name__  # "AIMessage", "ToolMessage", etc.
+            name = prefix or getattr(m, "name", None) or getattr(m, "role", None) or "agent"
+
+            if mtype in ("AIMessage", "ToolMessage"):
+                emit(name, getattr(m, "content", ""))
+
+    # 1) Top-level messages (if present)
+    if isinstance(chunk.get("messages"), list):
+        emit_filtered_from_messages(chunk["messages"])
+
+    # 2) Node-keyed outputs: preserve node labels
+    for node_key in AGENT_NODES:
+        if node_key in chunk:
+            node_val = chunk[node_key]
+            # Common shape: dict with "messages": [...]
+            if isinstance(node_val, dict) and isinstance(node_val.get("messages"), list):
+                emit_filtered_from_messages(node_val["messages"], prefix=node_key)
+            else:
+                # Fallback: single message-like object with .content
+                content = (
+                    getattr(node_val, "content", None)
+                    or (node_val.get("content") if isinstance(node_val, dict) else None)
+                )
+                if content:
+                    emit(node_key, content)
+
+    return events
+
+def last_ai_text(chunk: dict, nodes=SUMMARY_NODES) -> str:
+    """Return the text of the last AI message from the given nodes in a chunk, or an empty string"""
+    text = ""
+    for node_key, node_val in chunk.items():
+        if node_key not in nodes:
+            continue
+        messages = node_val.get("messages") if isinstance(node_val, dict) else None
+        for m in messages or []:
+            content = getattr(m, "content", None)
+            if type(m).__name__ == "AIMessage" and isinstance(content, str) and content.strip():
+                text = content.strip()
+    return text
 
 class MainGraph:
-    def __init__(self):
-        self.supervisor_agent = SupervisorAgent()
+    def __init__(self, mode: str = GRAPH_MODE):
+        if mode not in GRAPH_MODES:
+            raise ValueError(f"Unsupported graph mode: {mode}. Options: {', '.join(GRAPH_MODES)}")
+        self.mode = mode
         self.global_context_agent = GlobalContextAgent()
         self.local_context_agent = LocalContextAgent()
         self.music_generation_agent = MusicGenerationAgent()
         self.memory_agent = MemoryAgent()
         self.reinforcement_agent = ReinforcementAgent()
-        self.graph = self.supervisor_agent.get_supervisor(
-            sub_agents=[
-                self.global_context_agent.get_agent(),
-                self.local_context_agent.get_agent(),
-                self.music_generation_agent.get_agent(),
-                self.memory_agent.get_agent(),
-                self.reinforcement_agent.get_agent()
-            ]
-        ).compile()
+        if mode == "pipeline":
+            self.graph = self._build_dag([(name,) for name in PIPELINE_INSTRUCTIONS])
+        elif mode == "parallel":
+            self.graph = self._build_dag(PARALLEL_STAGES)
+        else:
+            self.supervisor_agent = SupervisorAgent()
+            self.graph = self.supervisor_agent.get_supervisor(
+                sub_agents=[
+                    self.global_context_agent.get_agent(),
+                    self.local_context_agent.get_agent(),
+                    self.music_generation_agent.get_agent(),
+                    self.memory_agent.get_agent(),
+                    self.reinforcement_agent.get_agent()
+                ]
+            ).compile()
+        print(f"MainGraph built in {mode} mode")
 
-    
+    def _pipeline_agents(self) -> dict:
+        """Sub-agents keyed by pipeline node name, in the order the supervisor prompt prescribes"""
+        return {
+            "global_context_agent": self.global_context_agent.get_agent(),
+            "local_context_agent": self.local_context_agent.get_agent(),
+            "memory_agent": self.memory_agent.get_agent(),
+            "reinforcement_agent": self.reinforcement_agent.get_agent(),
+            "music_generation_agent": self.music_generation_agent.get_agent(),
+            # The memory agent runs a second time to store the new generation
+            "memory_store": self.memory_agent.get_agent(),
+        }
+
+    def _agent_node(self, agent, instruction: str):
+        """Wrap a sub-agent as a graph node that adds only its final message to the state"""
+        def run(state: MessagesState, config: RunnableConfig):
+            messages = state["messages"] + [HumanMessage(content=instruction)]
+            result = agent.invoke({"messages": messages}, config)
+            return {"messages": [result["messages"][-1]]}
+        return run
+
+    def _build_dag(self, stages):
+        """Static DAG running the sub-agents stage by stage with explicit edges.
+
+        Nodes in one stage run concurrently; a node with several predecessors
+        waits for all of them, which joins their messages into the state.
+        """
+        agents = self._pipeline_agents()
+        builder = StateGraph(MessagesState)
+        previous = [START]
+        for stage in stages:
+            for name in stage:
+                builder.add_node(name, self._agent_node(agents[name], PIPELINE_INSTRUCTIONS[name]))
+                builder.add_edge(previous[0] if len(previous) == 1 else previous, name)
+            previous = list(stage)
+        builder.add_edge(previous[0] if len(previous) == 1 else previous, END)
+        return builder.compile()
+
+    def run_config(self, location: str = None) -> dict:
+        """Config passed to every graph run.
+
+        The cancellation check comes first so a cancelled job never takes an LLM slot.
+        location is the user's query (an address), which keys the global context cache.
+        """
+        config = {"callbacks": [cancellation_handler, llm_slot_handler]}
+        if location:
+            config["configurable"] = {"location": location}
+        return config
+
+    def stream(self, inputs: dict, location: str = None):
+        """Stream graph chunks with the shared run config"""
+        return self.graph.stream(inputs, config=self.run_config(location))
+
+    def build_inputs(self, query: str, img_url: str, user_feedback: str = "") -> dict:
+        messages = [("user", f"{query} {img_url}")]
+        if user_feedback:
+            messages.append(("user", f"User feedback: {user_feedback}"))
+        return {"messages": messages}
+
+    def stream_events(self, query: str, img_url: str, user_feedback: str = ""):
+        """Run the graph synchronously, yielding client events.
+
+        The final "done" event carries the last AI message as its summary.
+        Raises JobCancelled between graph steps once the current job is cancelled.
+        """
+        summary = ""
+        check_cancelled()
+        for chunk in self.stream(self.build_inputs(query, img_url, user_feedback), location=query):
+            check_cancelled()
+            if chunk is None:
+                continue
+            summary = last_ai_text(chunk) or summary
+            for event in chunk_to_events(chunk):
+                yield event
+        yield {"type": "done", "summary": summary}
     
     def run_with_feedback(self, query: str, img_url: str, user_feedback: str = ""):
         """Run the system and optionally provide feedback for learning"""
         inputs = {"messages": [("user", query + " " + img_url)]}
-        result = self.graph.invoke(inputs)
+        result = self.graph.invoke(inputs, config=self.run_config(location=query))
         
         # If user provided feedback, learn from it
         if user_feedback:
@@ -51,7 +244,7 @@ class MainGraph:
         inputs = {"messages": [("user", f"{query} {img_url}")]}
         yield {"type": "status", "message": "Starting intelligent ambience system..."}
 
-        for chunk in self.graph.stream(inputs):
+        for chunk in self.stream(inputs):
             # Map LangGraph chunks into simple events
             for key, value in chunk.items():
                 if key == "messages":
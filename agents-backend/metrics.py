@@ -0,0 +1,53 @@
+"""
+In-process metrics: counters and timing observations
+
+Kept deliberately small; exposed as JSON by the /metrics endpoint.
+"""
+
+import threading
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._observations = {}
+
+    def increment(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float):
+        """Record one sample of a value such as a duration or a rate"""
+        with self._lock:
+            stats = self._observations.get(name)
+            if stats is None:
+                self._observations[name] = {"count": 1, "sum": value, "min": value, "max": value, "last": value}
+                return
+            stats["count"] += 1
+            stats["sum"] += value
+            stats["min"] = min(stats["min"], value)
+            stats["max"] = max(stats["max"], value)
+            stats["last"] = value
+
+    def counter(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def hit_rate(self, prefix: str) -> float:
+        """Hit rate of a <prefix>.hits / <prefix>.misses counter pair"""
+        with self._lock:
+            hits = self._counters.get(f"{prefix}.hits", 0)
+            misses = self._counters.get(f"{prefix}.misses", 0)
+        return hits / (hits + misses) if hits + misses else 0.0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            observations = {
+                name: {**stats, "mean": stats["sum"] / stats["count"]}
+                for name, stats in self._observations.items()
+            }
+            return {"counters": dict(self._counters), "observations": observations}
+
+
+metrics = Metrics()
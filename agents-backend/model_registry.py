@@ -0,0 +1,115 @@
+"""
+Registry of the system's heavy models and stores
+
+Models are registered with a loader and a load policy instead of being built
+at import time:
+- lazy: loaded on first use
+- eager: loaded by the background warm-up started after the server is up
+Every model is still loaded on first use if warm-up hasn't reached it yet.
+The policy of a model can be overridden with MODEL_POLICY_<NAME>=lazy|eager.
+"""
+
+import os
+import threading
+import time
+from dotenv import load_dotenv
+load_dotenv()
+
+POLICIES = ("lazy", "eager")
+
+# Model states
+UNLOADED = "unloaded"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+class _Entry:
+    def __init__(self, name: str, loader, policy: str):
+        self.name = name
+        self.loader = loader
+        self.policy = policy
+        self.state = UNLOADED
+        self.instance = None
+        self.load_time = None
+        self.error = None
+        self.lock = threading.Lock()
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._entries = {}
+        self._warm_up_thread = None
+
+    def register(self, name: str, loader, policy: str = "lazy"):
+        """Register a zero-argument loader under name"""
+        policy = os.getenv(f"MODEL_POLICY_{name.upper()}", policy)
+        if policy not in POLICIES:
+            raise ValueError(f"Unsupported load policy for {name}: {policy}. Options: {', '.join(POLICIES)}")
+        if name not in self._entries:
+            self._entries[name] = _Entry(name, loader, policy)
+
+    def get(self, name: str):
+        """Return the loaded model, loading it first if needed. Thread-safe."""
+        entry = self._entries[name]
+        if entry.state == READY:
+            return entry.instance
+        with entry.lock:
+            if entry.state != READY:
+                self._load(entry)
+            return entry.instance
+
+    def is_loaded(self, name: str) -> bool:
+        entry = self._entries.get(name)
+        return entry is not None and entry.state == READY
+
+    def warm_up(self):
+        """Load every eager model, one at a time so they don't compete for the GPU"""
+        for entry in list(self._entries.values()):
+            if entry.policy != "eager":
+                continue
+            try:
+                self.get(entry.name)
+            except Exception:
+                # Recorded on the entry and reported by status(); keep warming the others
+                pass
+
+    def start_warm_up(self):
+        """Warm up eager models on a background thread"""
+        if self._warm_up_thread is None:
+            self._warm_up_thread = threading.Thread(target=self.warm_up, name="model-warm-up", daemon=True)
+            self._warm_up_thread.start()
+
+    def ready(self) -> bool:
+        """True once every eager model has loaded"""
+        return all(entry.state == READY for entry in self._entries.values() if entry.policy == "eager")
+
+    def status(self) -> dict:
+        return {
+            entry.name: {
+                "policy": entry.policy,
+                "state": entry.state,
+                "load_time": round(entry.load_time, 2) if entry.load_time is not None else None,
+                "error": entry.error,
+            }
+            for entry in self._entries.values()
+        }
+
+    def _load(self, entry: _Entry):
+        print(f"Loading model: {entry.name}")
+        entry.state = LOADING
+        entry.error = None
+        start = time.perf_counter()
+        try:
+            entry.instance = entry.loader()
+        except Exception as e:
+            entry.state = FAILED
+            entry.error = str(e)
+            print(f"Failed to load {entry.name}: {e}")
+            raise
+        entry.load_time = time.perf_counter() - start
+        entry.state = READY
+        print(f"Loaded {entry.name} in {entry.load_time:.1f}s")
+
+
+model_registry = ModelRegistry()
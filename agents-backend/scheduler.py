@@ -0,0 +1,261 @@
+"""
+Admission control and resource limits for generation jobs
+
+JobScheduler bounds how many jobs run through MainGraph at once and how many
+may wait for a slot. ResourceLimiter bounds how many threads may use a shared
+model (LLM, captioner, diffusion) at the same time.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+from job_context import check_cancelled
+from dotenv import load_dotenv
+load_dotenv()
+
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "2"))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "8"))
+
+MAX_CONCURRENT_LLM = os.getenv("MAX_CONCURRENT_LLM", "2")
+
+RESOURCE_LIMITS = {
+    "llm": int(MAX_CONCURRENT_LLM),
+    # In-flight chat model calls per LLM backend, defaulting to MAX_CONCURRENT_LLM
+    "llm:ollama": int(os.getenv("MAX_CONCURRENT_LLM_OLLAMA", MAX_CONCURRENT_LLM)),
+    "llm:openai": int(os.getenv("MAX_CONCURRENT_LLM_OPENAI", MAX_CONCURRENT_LLM)),
+    "llm:anthropic": int(os.getenv("MAX_CONCURRENT_LLM_ANTHROPIC", MAX_CONCURRENT_LLM)),
+    "captioner": int(os.getenv("MAX_CONCURRENT_CAPTIONER", "1")),
+    "diffusion": int(os.getenv("MAX_CONCURRENT_DIFFUSION", "1")),
+}
+# An LLM slot held longer than this is assumed to belong to a run that will never report its end
+LLM_SLOT_MAX_SECONDS = float(os.getenv("LLM_SLOT_MAX_SECONDS", "600"))
+# How often a thread waiting for an LLM slot checks for cancellation and expired slots
+_LLM_SLOT_CHECK_SECONDS = 0.5
+
+
+class SchedulerBusy(Exception):
+    """Raised when a job is submitted while the wait queue is full"""
+
+
+class Ticket:
+    """A job's place in the scheduler: either holding a slot or waiting for one"""
+
+    def __init__(self, scheduler, future, on_position=None):
+        self._scheduler = scheduler
+        self._future = future
+        self.on_position = on_position
+        self._released = False
+
+    @property
+    def granted(self) -> bool:
+        return self._future.done() and not self._future.cancelled()
+
+    async def wait(self):
+        """Wait until the ticket holds a running slot"""
+        await asyncio.shield(self._future)
+
+    def release(self):
+        """Give the slot back, or leave the queue if still waiting"""
+        if self._released:
+            return
+        self._released = True
+        if self.granted:
+            self._scheduler._release()
+        else:
+            self._future.cancel()
+            self._scheduler._leave_queue(self)
+
+
+class JobScheduler:
+    """FIFO scheduler with a running limit and a bounded wait queue.
+
+    Must be used from the event loop thread.
+    """
+
+    def __init__(self, max_running: int = MAX_CONCURRENT_JOBS, max_queued: int = MAX_QUEUED_JOBS):
+        self.max_running = max(1, max_running)
+        self.max_queued = max(0, max_queued)
+        self._running = 0
+        self._waiting = deque()
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiting)
+
+    def admit(self, on_position=None) -> Ticket:
+        """Reserve a slot or a place in the queue.
+
+        Raises SchedulerBusy immediately when the queue is full. on_position is
+        called with the 1-based queue position every time it changes.
+        """
+        future = asyncio.get_running_loop().create_future()
+        ticket = Ticket(self, future, on_position)
+
+        if self._running < self.max_running and not self._waiting:
+            self._running += 1
+            future.set_result(True)
+            return ticket
+
+        if len(self._waiting) >= self.max_queued:
+            raise SchedulerBusy(
+                f"Server is busy: {self._running} jobs running and {len(self._waiting)} waiting"
+            )
+
+        self._waiting.append(ticket)
+        self._notify_positions(start=len(self._waiting) - 1)
+        return ticket
+
+    @asynccontextmanager
+    async def slot(self, on_position=None):
+        """Hold a running slot for the duration of the block"""
+        ticket = self.admit(on_position)
+        try:
+            await ticket.wait()
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self) -> dict:
+        return {
+            "running": self._running,
+            "queued": len(self._waiting),
+            "max_running": self.max_running,
+            "max_queued": self.max_queued,
+        }
+
+    def _release(self):
+        # Hand the slot straight to the next waiter so a new arrival cannot jump the queue
+        while self._waiting:
+            ticket = self._waiting.popleft()
+            if not ticket._future.done():
+                ticket._future.set_result(True)
+                self._notify_positions()
+                return
+        self._running -= 1
+
+    def _leave_queue(self, ticket: Ticket):
+        try:
+            index = self._waiting.index(ticket)
+        except ValueError:
+            return
+        del self._waiting[index]
+        self._notify_positions(start=index)
+
+    def _notify_positions(self, start: int = 0):
+        for position, ticket in enumerate(list(self._waiting)[start:], start + 1):
+            if ticket.on_position:
+                try:
+                    ticket.on_position(position)
+                except Exception as e:
+                    print(f"Queue position callback failed: {e}")
+
+
+class ResourceLimiter:
+    """Per-resource concurrency limits for threads sharing one GPU.
+
+    Resources without a configured limit are not restricted.
+    """
+
+    def __init__(self, limits: dict):
+        self.limits = dict(limits)
+        self._semaphores = {
+            name: threading.BoundedSemaphore(limit)
+            for name, limit in self.limits.items()
+            if limit > 0
+        }
+
+    @contextmanager
+    def acquire(self, resource: str):
+        semaphore = self._semaphores.get(resource)
+        if semaphore is None:
+            yield
+            return
+        with semaphore:
+            yield
+
+    def hold(self, resource: str, timeout: float = None) -> bool:
+        """Block until a slot is free, or until timeout; pair a successful hold with release()"""
+        semaphore = self._semaphores.get(resource)
+        if semaphore is None:
+            return True
+        return semaphore.acquire(timeout=timeout)
+
+    def release(self, resource: str):
+        semaphore = self._semaphores.get(resource)
+        if semaphore is not None:
+            semaphore.release()
+
+
+class LLMSlotHandler(BaseCallbackHandler):
+    """Callback handler that holds an LLM slot for every chat model call.
+
+    Passed in the graph config so it applies to every agent, including the
+    supervisor. The slot is taken from the "llm:<provider>" limit of the
+    model's backend, falling back to the generic "llm" limit. A run that is
+    abandoned without on_llm_end or on_llm_error would keep its slot, so slots
+    held longer than max_seconds are taken back when another run is waiting.
+    A job cancelled while waiting raises JobCancelled instead of taking a slot.
+    """
+
+    # Without this LangChain logs and swallows JobCancelled
+    raise_error = True
+
+    def __init__(self, limiter: ResourceLimiter, resource: str = "llm", max_seconds: float = LLM_SLOT_MAX_SECONDS):
+        self.limiter = limiter
+        self.resource = resource
+        self.max_seconds = max_seconds
+        self._held = {}  # run_id -> (resource, time acquired)
+        self._lock = threading.Lock()
+
+    def _resource_for(self, metadata) -> str:
+        provider = (metadata or {}).get("ls_provider")
+        resource = f"{self.resource}:{provider}"
+        return resource if resource in self.limiter.limits else self.resource
+
+    def _acquire(self, run_id, metadata):
+        resource = self._resource_for(metadata)
+        while not self.limiter.hold(resource, timeout=_LLM_SLOT_CHECK_SECONDS):
+            check_cancelled()
+            self._expire()
+        with self._lock:
+            self._held[run_id] = (resource, time.monotonic())
+
+    def _release(self, run_id):
+        with self._lock:
+            held = self._held.pop(run_id, None)
+        if held is not None:
+            self.limiter.release(held[0])
+
+    def _expire(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [run_id for run_id, (_, acquired) in self._held.items() if now - acquired > self.max_seconds]
+        for run_id in expired:
+            print(f"Reclaiming LLM slot of run {run_id}, held for over {self.max_seconds:.0f}s")
+            self._release(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self._acquire(run_id, metadata)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self._acquire(run_id, metadata)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._release(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._release(run_id)
+
+
+job_scheduler = JobScheduler()
+resource_limiter = ResourceLimiter(RESOURCE_LIMITS)
+llm_slot_handler = LLMSlotHandler(resource_limiter)
@@ -0,0 +1,144 @@
+"""
+Per-job output directories and content-addressed final artifacts
+
+Each job writes its files to its own directory under ARTIFACT_DIR/jobs, so
+concurrent jobs never overwrite each other. The final mix is then moved to
+ARTIFACT_DIR/objects under its SHA-256, and the job's result records that
+hash. Identical mixes are stored once. Compressed encodings of a mix are
+kept under ARTIFACT_DIR/encodings. Artifacts and encodings older than
+ARTIFACT_MAX_AGE_SECONDS, and the least recently used beyond
+ARTIFACT_MAX_BYTES, are garbage collected; so are encodings of collected mixes
+and job directories left behind by a crashed worker.
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+from dotenv import load_dotenv
+load_dotenv()
+
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "artifacts")
+ARTIFACT_MAX_BYTES = int(os.getenv("ARTIFACT_MAX_BYTES", str(1024 * 1024 * 1024)))
+ARTIFACT_MAX_AGE_SECONDS = int(os.getenv("ARTIFACT_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+
+_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+_CHUNK_SIZE = 1024 * 1024
+
+
+class ArtifactStore:
+    def __init__(self, root: str = ARTIFACT_DIR, max_bytes: int = ARTIFACT_MAX_BYTES,
+                 max_age_seconds: int = ARTIFACT_MAX_AGE_SECONDS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.objects_dir = os.path.join(root, "objects")
+        self.jobs_dir = os.path.join(root, "jobs")
+        self.encodings_dir = os.path.join(root, "encodings")
+        self._lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.encodings_dir, exist_ok=True)
+        os.makedirs(self.jobs_dir, exist_ok=True)
+
+    def job_dir(self, job_id: str) -> str:
+        """The job's private output directory, created on first use"""
+        path = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def put(self, path: str) -> str:
+        """Move a finished file into the store and return its content hash"""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+        with self._lock:
+            object_path = self._object_path(content_hash, os.path.splitext(path)[1])
+            if os.path.exists(object_path):
+                # Same mix as an earlier job: keep one copy and mark it as recently used
+                os.remove(path)
+                os.utime(object_path)
+            else:
+                os.replace(path, object_path)
+            self._collect()
+        return content_hash
+
+    def path(self, content_hash: str):
+        """Path of a stored artifact, or None if it is unknown or was collected"""
+        if not _HASH_PATTERN.match(content_hash or ""):
+            return None
+        with self._lock:
+            for entry in os.scandir(self.objects_dir):
+                if entry.name.startswith(content_hash):
+                    os.utime(entry.path)
+                    return entry.path
+        return None
+
+    def encoding_path(self, content_hash: str, extension: str) -> str:
+        """Where an encoding of a stored artifact is kept; the caller writes it"""
+        if not _HASH_PATTERN.match(content_hash or ""):
+            raise ValueError(f"Invalid artifact hash {content_hash}")
+        return os.path.join(self.encodings_dir, content_hash + extension)
+
+    def gc(self) -> dict:
+        """Remove expired artifacts, stale job directories and anything over the size budget"""
+        with self._lock:
+            return self._collect()
+
+    def stats(self) -> dict:
+        with self._lock:
+            sizes = [entry.stat().st_size for entry in os.scandir(self.objects_dir) if entry.is_file()]
+            encoding_sizes = [entry.stat().st_size for entry in os.scandir(self.encodings_dir) if entry.is_file()]
+        return {
+            "artifacts": len(sizes),
+            "encodings": len(encoding_sizes),
+            "bytes": sum(sizes) + sum(encoding_sizes),
+            "max_bytes": self.max_bytes,
+        }
+
+    def _object_path(self, content_hash: str, extension: str) -> str:
+        return os.path.join(self.objects_dir, content_hash + extension)
+
+    def _collect(self) -> dict:
+        # Called with the lock held
+        now = time.time()
+        removed = 0
+        freed = 0
+        entries = []
+        stored = {entry.name.split(".")[0] for entry in os.scandir(self.objects_dir)}
+        for entry in [*os.scandir(self.objects_dir), *os.scandir(self.encodings_dir)]:
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            # Partial files belong to encodings still being written, unless a crash left them behind
+            if entry.name.endswith(".part"):
+                if now - stat.st_mtime > self.max_age_seconds:
+                    os.remove(entry.path)
+                continue
+            orphan = entry.path.startswith(self.encodings_dir) and entry.name.split(".")[0] not in stored
+            if orphan or now - stat.st_mtime > self.max_age_seconds:
+                os.remove(entry.path)
+                removed += 1
+                freed += stat.st_size
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            removed += 1
+            freed += size
+
+        # Job directories are removed when their job ends, so old ones belong to crashed workers
+        for entry in os.scandir(self.jobs_dir):
+            if entry.is_dir() and now - entry.stat().st_mtime > self.max_age_seconds:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        return {"removed": removed, "bytes_freed": freed}
+
+
+artifact_store = ArtifactStore()
@@ -0,0 +1,219 @@
+"""
+Compressed delivery of finished mixes
+
+Mixes are stored as WAV; clients get Opus, MP3, FLAC or WAV, chosen by the
+Accept header (or an explicit format). An encoding is written once next to the
+artifact and reused. Ogg/Opus is written strictly front to back, so while it
+is being encoded readers can follow the growing file and the first listener
+starts receiving audio before encoding finishes. MP3 and FLAC are not: on close
+libsndfile goes back and rewrites their headers (Xing/LAME frame, FLAC
+STREAMINFO), so they are only served once complete. Complete files are served
+with byte-range support.
+"""
+
+import asyncio
+import io
+import os
+import threading
+import numpy as np
+import soundfile as sf
+from scipy.signal import resample_poly
+from tools.artifact_store import artifact_store
+from dotenv import load_dotenv
+load_dotenv()
+
+# name -> (media type, soundfile format, subtype, extension, compression level)
+# libsndfile maps the compression level to a bitrate: about 90 kbps for stereo Opus, 128 kbps for MP3
+AUDIO_FORMATS = {
+    "opus": ("audio/ogg", "OGG", "OPUS", ".opus", 0.85),
+    "mp3": ("audio/mpeg", "MP3", "MPEG_LAYER_III", ".mp3", 0.5),
+    "flac": ("audio/flac", "FLAC", "PCM_16", ".flac", 0.5),
+    "wav": ("audio/wav", "WAV", None, ".wav", None),
+}
+# Format of the stems pushed over the WebSocket while a job runs
+STEM_STREAM_FORMAT = os.getenv("STEM_STREAM_FORMAT", "mp3")
+# Chosen in this order when the client accepts several equally, e.g. */*
+AUDIO_FORMAT_PREFERENCE = [name for name in os.getenv("AUDIO_FORMAT_PREFERENCE", "mp3,opus,flac,wav").split(",") if name]
+AUDIO_CHUNK_BYTES = 64 * 1024
+
+_MEDIA_TYPES = {
+    "audio/ogg": "opus", "audio/opus": "opus", "application/ogg": "opus",
+    "audio/mpeg": "mp3", "audio/mp3": "mp3",
+    "audio/flac": "flac", "audio/x-flac": "flac",
+    "audio/wav": "wav", "audio/x-wav": "wav", "audio/wave": "wav",
+}
+_OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+# Formats whose bytes never change once written, so a partial file can be streamed
+STREAMABLE_WHILE_ENCODING = ("opus",)
+_BLOCK_SECONDS = 1
+
+
+def negotiate(accept: str):
+    """Pick a format name for an Accept header, or None if the client accepts none of them"""
+    if not accept:
+        return AUDIO_FORMAT_PREFERENCE[0]
+    best = {}  # format -> (q, specificity)
+    for part in accept.split(","):
+        media_type, *params = [item.strip() for item in part.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if media_type in _MEDIA_TYPES:
+            matches, specificity = [_MEDIA_TYPES[media_type]], 2
+        elif media_type in ("audio/*", "*/*"):
+            matches, specificity = AUDIO_FORMAT_PREFERENCE, 1 if media_type == "audio/*" else 0
+        else:
+            continue
+        for name in matches:
+            # The most specific range decides a format's quality, as in RFC 9110
+            if name not in best or specificity > best[name][1]:
+                best[name] = (q, specificity)
+    candidates = [name for name in AUDIO_FORMAT_PREFERENCE if best.get(name, (0,))[0] > 0]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda name: (best[name][0], best[name][1], -AUDIO_FORMAT_PREFERENCE.index(name)))
+
+
+def parse_range(header: str, size: int):
+    """(start, end exclusive) for a single "bytes=" Range header.
+
+    Returns None when the header should be ignored (absent, malformed,
+    last byte before first byte or several ranges) and raises ValueError
+    when a valid range is unsatisfiable.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        suffix = int(end) if not start else None
+        start = int(start) if start else None
+        end = int(end) + 1 if start is not None and end else None
+    except ValueError:
+        return None
+    if suffix is not None:
+        # Suffix range: the last N bytes
+        if suffix <= 0:
+            raise ValueError(f"Range {header} is empty")
+        return max(size - suffix, 0), size
+    if end is not None and start >= end:
+        # An invalid range spec is ignored and the whole file served (RFC 9110)
+        return None
+    if start >= size:
+        raise ValueError(f"Range {header} not satisfiable for {size} bytes")
+    return start, min(end, size) if end is not None else size
+
+
+def _for_format(audio: np.ndarray, sample_rate: int, name: str):
+    # Opus only supports a few sample rates, so 44.1 kHz audio is resampled to 48 kHz
+    if name == "opus" and sample_rate not in _OPUS_SAMPLE_RATES:
+        return resample_poly(audio, 48000, sample_rate, axis=0).astype(np.float32), 48000
+    return audio, sample_rate
+
+
+def encode_audio(audio: np.ndarray, sample_rate: int, name: str = STEM_STREAM_FORMAT) -> bytes:
+    """Encode a (samples, channels) array in memory"""
+    _, file_format, subtype, _, compression_level = AUDIO_FORMATS[name]
+    audio, sample_rate = _for_format(audio, sample_rate, name)
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, sample_rate, subtype, format=file_format, compression_level=compression_level)
+    return buffer.getvalue()
+
+
+class Encoding:
+    """An encoding being written (or already written) for one artifact and format"""
+
+    def __init__(self, path: str, partial_path: str):
+        self.path = path
+        self.partial_path = partial_path
+        self.done = threading.Event()
+        self.error = None
+
+
+class AudioEncoder:
+    def __init__(self, store=artifact_store):
+        self.store = store
+        self._running = {}  # (content hash, format) -> Encoding
+        self._lock = threading.Lock()
+
+    def open(self, content_hash: str, source_path: str, name: str) -> Encoding:
+        """The encoding of an artifact in a format, starting it in the background if it does not exist"""
+        if name == "wav":
+            encoding = Encoding(source_path, source_path)
+            encoding.done.set()
+            return encoding
+        path = self.store.encoding_path(content_hash, AUDIO_FORMATS[name][3])
+        with self._lock:
+            encoding = self._running.get((content_hash, name))
+            if encoding is not None:
+                return encoding
+            encoding = Encoding(path, path + ".part")
+            if os.path.exists(path):
+                os.utime(path)
+                encoding.done.set()
+                return encoding
+            # Created before returning so readers can open it straight away
+            open(encoding.partial_path, "wb").close()
+            self._running[(content_hash, name)] = encoding
+        threading.Thread(target=self._encode, args=(content_hash, source_path, name, encoding), daemon=True).start()
+        return encoding
+
+    def _encode(self, content_hash: str, source_path: str, name: str, encoding: Encoding):
+        _, file_format, subtype, _, compression_level = AUDIO_FORMATS[name]
+        try:
+            audio, sample_rate = _for_format(*sf.read(source_path, dtype="float32", always_2d=True), name)
+            # Written in blocks so readers following the partial file receive audio as it is encoded
+            with sf.SoundFile(
+                encoding.partial_path, "w", sample_rate, audio.shape[1], subtype,
+                format=file_format, compression_level=compression_level,
+            ) as f:
+                block = sample_rate * _BLOCK_SECONDS
+                for start in range(0, len(audio), block):
+                    f.write(audio[start:start + block])
+                    f.flush()
+            os.replace(encoding.partial_path, encoding.path)
+        except Exception as e:
+            print(f"Encoding {content_hash} as {name} failed: {e}")
+            encoding.error = str(e)
+            if os.path.exists(encoding.partial_path):
+                os.remove(encoding.partial_path)
+        finally:
+            with self._lock:
+                self._running.pop((content_hash, name), None)
+            encoding.done.set()
+
+
+def iter_file(path: str, start: int = 0, end: int = None, done: threading.Event = None):
+    """Open a file and return an async iterator over its bytes from start to end, in chunks.
+
+    The file is opened straight away, so a partial encoding renamed afterwards
+    is still read to its end. While done is unset the iterator follows the
+    file as it grows.
+    """
+    f = open(path, "rb")
+    f.seek(start)
+    return _iter_chunks(f, start, end, done)
+
+
+async def _iter_chunks(f, position: int, end: int, done: threading.Event):
+    try:
+        while end is None or position < end:
+            # Checked before reading: if the writer had finished, an empty read means the end
+            finished = done is None or done.is_set()
+            size = AUDIO_CHUNK_BYTES if end is None else min(AUDIO_CHUNK_BYTES, end - position)
+            chunk = await asyncio.to_thread(f.read, size)
+            if chunk:
+                position += len(chunk)
+                yield chunk
+            elif finished:
+                break
+            else:
+                await asyncio.sleep(0.05)
+    finally:
+        f.close()
+
+
+audio_encoder = AudioEncoder()
@@ -0,0 +1,83 @@
+"""
+Cross-request micro-batching for the captioner
+
+Caption requests from concurrent jobs are queued to one worker thread, which
+waits up to CAPTION_MAX_WAIT_MS for more requests to arrive (or until
+CAPTION_MAX_BATCH_SIZE prompts are collected) and captions them all in one
+ImageCaptioning.caption_batch call.
+Callers block until their own captions are ready.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from scheduler import resource_limiter
+from metrics import metrics
+from dotenv import load_dotenv
+load_dotenv()
+
+CAPTION_BATCHING = os.getenv("CAPTION_BATCHING", "true").lower() == "true"
+CAPTION_MAX_BATCH_SIZE = int(os.getenv("CAPTION_MAX_BATCH_SIZE", "8"))
+CAPTION_MAX_WAIT_MS = float(os.getenv("CAPTION_MAX_WAIT_MS", "10"))
+
+
+class CaptionBatcher:
+    def __init__(self, get_captioner, max_batch_size: int = CAPTION_MAX_BATCH_SIZE,
+                 max_wait_ms: float = CAPTION_MAX_WAIT_MS):
+        self.get_captioner = get_captioner
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def caption(self, session, prompts: list) -> list:
+        """Caption one image session with several prompts, batched with other callers' requests"""
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((session, list(prompts), future))
+        return future.result()
+
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="caption-batcher", daemon=True)
+                self._worker.start()
+
+    def _collect(self) -> list:
+        """Block for the first request, then gather more until the batch is full or max_wait has passed"""
+        batch = [self._queue.get()]
+        size = len(batch[0][1])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request[1])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [(session, prompt) for session, prompts, _ in batch for prompt in prompts]
+            metrics.observe("caption_batcher.batch_size", len(items))
+            try:
+                captioner = self.get_captioner()
+                with resource_limiter.acquire("captioner"):
+                    captions = captioner.caption_batch(items)
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for _, prompts, future in batch:
+                future.set_result(captions[offset:offset + len(prompts)])
+                offset += len(prompts)
@@ -0,0 +1,89 @@
+"""
+Inference backends for the BLIP captioner
+
+- torch: the model as loaded, on CAPTION_DEVICE (cuda, or cpu when no GPU is present)
+- int8: dynamic int8 quantization of the Linear layers; runs on CPU only
+- onnx: the vision encoder exported to ONNX and run with ONNX Runtime, the
+  text decoder stays in torch. The vision encoder is most of the work per
+  image, and generate() needs torch's decoding loop.
+"""
+
+import os
+import torch
+from dotenv import load_dotenv
+load_dotenv()
+
+CAPTION_BACKENDS = ("torch", "int8", "onnx")
+CAPTION_BACKEND = os.getenv("CAPTION_BACKEND", "torch")
+# Options: auto (cuda when available), cuda, cpu
+CAPTION_DEVICE = os.getenv("CAPTION_DEVICE", "auto")
+CAPTION_ONNX_PATH = os.getenv("CAPTION_ONNX_PATH", "models/blip_vision_encoder.onnx")
+# Threads used by CPU inference; 0 keeps the library default
+CAPTION_NUM_THREADS = int(os.getenv("CAPTION_NUM_THREADS", "0"))
+
+
+def resolve_device(device: str, backend: str) -> str:
+    if backend not in CAPTION_BACKENDS:
+        raise ValueError(f"Unsupported caption backend: {backend}. Options: {', '.join(CAPTION_BACKENDS)}")
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    if backend == "int8" and device != "cpu":
+        print("int8 captioner runs on CPU only, ignoring CAPTION_DEVICE")
+        device = "cpu"
+    if device == "cpu" and CAPTION_NUM_THREADS:
+        torch.set_num_threads(CAPTION_NUM_THREADS)
+    return device
+
+
+def quantize_int8(model: torch.nn.Module) -> torch.nn.Module:
+    """Quantize Linear layer weights to int8; activations are quantized on the fly"""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class _VisionEncoderOutput(torch.nn.Module):
+    def __init__(self, vision_model):
+        super().__init__()
+        self.vision_model = vision_model
+
+    def forward(self, pixel_values):
+        return self.vision_model(pixel_values=pixel_values)[0]
+
+
+class OnnxVisionEncoder:
+    """BLIP vision encoder running in ONNX Runtime, exported on first use"""
+
+    def __init__(self, vision_model, image_size: int, device: str, path: str = CAPTION_ONNX_PATH):
+        import onnxruntime as ort
+
+        if not os.path.exists(path):
+            self.export(vision_model, image_size, path)
+
+        options = ort.SessionOptions()
+        if CAPTION_NUM_THREADS:
+            options.intra_op_num_threads = CAPTION_NUM_THREADS
+        providers = ["CPUExecutionProvider"]
+        if device == "cuda" and "CUDAExecutionProvider" in ort.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+        self.session = ort.InferenceSession(path, options, providers=providers)
+        self.device = device
+
+    @staticmethod
+    def export(vision_model, image_size: int, path: str):
+        print(f"Exporting BLIP vision encoder to {path}")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Exported from the CPU copy of the model, before it is moved to its device
+        wrapper = _VisionEncoderOutput(vision_model).eval()
+        dummy = torch.zeros(1, 3, image_size, image_size)
+        torch.onnx.export(
+            wrapper,
+            (dummy,),
+            path,
+            input_names=["pixel_values"],
+            output_names=["image_embeds"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+            opset_version=17,
+        )
+
+    def __call__(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        (image_embeds,) = self.session.run(["image_embeds"], {"pixel_values": pixel_values.cpu().numpy()})
+        return torch.from_numpy(image_embeds).to(self.device)
@@ -0,0 +1,80 @@
+"""
+Progress and throughput of diffusion runs
+
+Each pipeline call gets a DiffusionRun whose step() is called after every
+denoising step. It times the step, publishes a "progress" event to the job's
+clients (at most every DIFFUSION_PROGRESS_INTERVAL_SECONDS) and, when the run
+finishes, records its steps per second. Runs of the same shape (preset, batch
+size, duration) are compared with a moving baseline, and one below
+DIFFUSION_SLOWDOWN_RATIO of it is counted and logged as a slowdown, which
+usually means the GPU is throttling or shared.
+"""
+
+import os
+import threading
+import time
+from job_context import emit_event
+from metrics import metrics
+from dotenv import load_dotenv
+load_dotenv()
+
+DIFFUSION_PROGRESS_INTERVAL_SECONDS = float(os.getenv("DIFFUSION_PROGRESS_INTERVAL_SECONDS", "0.25"))
+DIFFUSION_SLOWDOWN_RATIO = float(os.getenv("DIFFUSION_SLOWDOWN_RATIO", "0.6"))
+# Weight of the newest run in the moving baseline
+_BASELINE_SMOOTHING = 0.2
+
+
+class DiffusionRun:
+    def __init__(self, monitor, label: str, total_steps: int, key: tuple):
+        self.monitor = monitor
+        self.label = label
+        self.total_steps = total_steps
+        self.key = key
+        self.completed = 0
+        self.started = self.last_step = self.last_event = time.perf_counter()
+
+    def step(self, step: int):
+        now = time.perf_counter()
+        metrics.observe("diffusion.step_seconds", now - self.last_step)
+        self.last_step = now
+        self.completed = step + 1
+        if self.completed >= self.total_steps or now - self.last_event >= DIFFUSION_PROGRESS_INTERVAL_SECONDS:
+            self.last_event = now
+            emit_event({
+                "type": "progress",
+                "step": f"{self.label} step {self.completed}/{self.total_steps}",
+                "percent": int(100 * self.completed / self.total_steps),
+                "steps_per_second": round(self.completed / (now - self.started), 2),
+            })
+
+    def finish(self) -> float:
+        """Record the run's throughput and return it in steps per second"""
+        elapsed = time.perf_counter() - self.started
+        rate = self.completed / elapsed if elapsed > 0 else 0.0
+        metrics.observe("diffusion.steps_per_second", rate)
+        metrics.observe("diffusion.run_seconds", elapsed)
+        self.monitor.record(self.key, rate)
+        return rate
+
+
+class DiffusionMonitor:
+    def __init__(self, slowdown_ratio: float = DIFFUSION_SLOWDOWN_RATIO):
+        self.slowdown_ratio = slowdown_ratio
+        self._baselines = {}  # run shape -> moving average steps per second
+        self._lock = threading.Lock()
+
+    def start(self, label: str, total_steps: int, key: tuple) -> DiffusionRun:
+        return DiffusionRun(self, label, total_steps, key)
+
+    def record(self, key: tuple, rate: float):
+        with self._lock:
+            baseline = self._baselines.get(key)
+            self._baselines[key] = rate if baseline is None else baseline + _BASELINE_SMOOTHING * (rate - baseline)
+        if baseline is not None and rate < baseline * self.slowdown_ratio:
+            metrics.increment("diffusion.slowdowns")
+            print(f"Diffusion slowdown for {key}: {rate:.2f} steps/s against a baseline of {baseline:.2f}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            baselines = {"/".join(str(part) for part in key): round(rate, 2) for key, rate in self._baselines.items()}
+        return {"baseline_steps_per_second": baselines, "slowdowns": metrics.counter("diffusion.slowdowns")}
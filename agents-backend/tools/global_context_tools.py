@@ -1,6 +1,53 @@
 from langchain_tavily import TavilySearch
 from langchain_core.tools import tool
+from tools.ttl_cache import TTLCache, time_bucket
 import datetime
+import os
+import threading
+from dotenv import load_dotenv
+load_dotenv()
+
+# Search results and the final global context change slowly (weather, news), so both
+# are cached per query/location for one time bucket, by default an hour
+SEARCH_CACHE_TTL_SECONDS = int(os.getenv("SEARCH_CACHE_TTL_SECONDS", "3600"))
+GLOBAL_CONTEXT_TTL_SECONDS = int(os.getenv("GLOBAL_CONTEXT_TTL_SECONDS", "3600"))
+
+search_cache = TTLCache("search_cache", SEARCH_CACHE_TTL_SECONDS)
+global_context_cache = TTLCache("global_context_cache", GLOBAL_CONTEXT_TTL_SECONDS)
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+def search_cache_key(query: str) -> str:
+    return f"search:{time_bucket(SEARCH_CACHE_TTL_SECONDS)}:{_normalize(query)}"
+
+def normalize_location(address: str) -> str:
+    """Reduce an address to its last two parts, e.g. town and country, without numbers.
+
+    Weather and news are shared by a whole town, so "12 Rue de Rivoli, 75001 Paris, France"
+    and "Paris, France" give the same location.
+    """
+    parts = [" ".join(word for word in part.split() if not any(char.isdigit() for char in word))
+             for part in address.split(",")]
+    return _normalize(", ".join([part for part in parts if part][-2:]))
+
+def global_context_key(location: str) -> str:
+    """Cache key for the global context of a location in the current time bucket"""
+    return f"global_context:{time_bucket(GLOBAL_CONTEXT_TTL_SECONDS)}:{normalize_location(location)}"
+
+class SearchFailed(Exception):
+    """Tavily returned an error instead of results"""
+
+_search_client = None
+_search_client_lock = threading.Lock()
+
+def get_search_client() -> TavilySearch:
+    """Shared Tavily client, created on first use"""
+    global _search_client
+    with _search_client_lock:
+        if _search_client is None:
+            _search_client = TavilySearch(max_results=5)
+        return _search_client
 
 def get_global_context_tools():
     """Get all the context tools for the agent"""
@@ -15,8 +62,17 @@ def get_current_time(query: str = "") -> str:
     now = datetime.datetime.now()
     return f"Current time: {now.strftime('%Y-%m-%d %H:%M:%S')}"
 
+def _search(query: str):
+    # TavilySearch.run reports failures as {"error": exception}; raising keeps them out of the cache
+    result = get_search_client().run(query)
+    if isinstance(result, dict) and "error" in result:
+        raise SearchFailed(str(result["error"]))
+    return result
+
 @tool
 def search_the_web(query: str) -> str:
     """Search the web for information"""
-    results = TavilySearch(max_results=5).run(query)
-    return results
\ No newline at end of file
+    try:
+        return search_cache.get_or_compute(search_cache_key(query), lambda: _search(query))
+    except SearchFailed as e:
+        return f"Error searching the web: {e}"
@@ -0,0 +1,303 @@
+"""
+Bounded image fetching and decoding
+
+Images are fetched through one pooled HTTP session with connect/read timeouts
+and a byte limit, cached on disk by content hash, and decoded at reduced size:
+BLIP resizes everything to 384px, so full-resolution decodes of phone photos
+only cost memory and time.
+
+Images uploaded with a request are downscaled on arrival and kept in memory,
+referenced as upload://<content hash> wherever an image URL is accepted. While
+an unfinished job refers to an upload it is also kept on disk, so the job
+still finds its image if it is resumed after a restart.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+from dotenv import load_dotenv
+load_dotenv()
+
+IMAGE_FETCH_CONNECT_TIMEOUT = float(os.getenv("IMAGE_FETCH_CONNECT_TIMEOUT", "3.05"))
+IMAGE_FETCH_READ_TIMEOUT = float(os.getenv("IMAGE_FETCH_READ_TIMEOUT", "10"))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(20 * 1024 * 1024)))
+# Images are rejected before decoding above this many pixels
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(50_000_000)))
+# Longest side of decoded images
+IMAGE_DECODE_MAX_SIZE = int(os.getenv("IMAGE_DECODE_MAX_SIZE", "768"))
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "image_cache")
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(500 * 1024 * 1024)))
+# How long a URL is assumed to point at the same image
+IMAGE_CACHE_URL_TTL_SECONDS = int(os.getenv("IMAGE_CACHE_URL_TTL_SECONDS", "300"))
+# Memory held by uploaded images (after downscaling) before the oldest are dropped
+IMAGE_UPLOAD_STORE_MAX_BYTES = int(os.getenv("IMAGE_UPLOAD_STORE_MAX_BYTES", str(100 * 1024 * 1024)))
+# Disk copies of uploads held by unfinished jobs; copies older than the max age were left by a crash
+IMAGE_UPLOAD_DIR = os.getenv("IMAGE_UPLOAD_DIR", os.path.join(IMAGE_CACHE_DIR, "uploads"))
+IMAGE_UPLOAD_MAX_AGE_SECONDS = int(os.getenv("IMAGE_UPLOAD_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+
+UPLOAD_SCHEME = "upload://"
+_UPLOAD_REF_PATTERN = re.compile(r"^upload://([0-9a-f]{64})$")
+
+_CHUNK_SIZE = 64 * 1024
+
+
+class ImageFetchError(ValueError):
+    """The image could not be fetched or decoded within the configured limits"""
+
+
+class ImageFetcher:
+    def __init__(self, cache_dir: str = IMAGE_CACHE_DIR, max_bytes: int = IMAGE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._cache_lock = threading.Lock()
+        os.makedirs(os.path.join(cache_dir, "urls"), exist_ok=True)
+
+    def fetch(self, img_url: str) -> bytes:
+        """Bytes of the image at a URL, upload reference or local path"""
+        if img_url.startswith(UPLOAD_SCHEME):
+            return upload_store.get(img_url)
+        if not img_url.startswith(('http://', 'https://')):
+            return self._read_file(img_url)
+
+        data = self._cached_url(img_url)
+        if data is not None:
+            return data
+        data = self._download(img_url)
+        self._store(img_url, data)
+        return data
+
+    def _read_file(self, path: str) -> bytes:
+        try:
+            if os.path.getsize(path) > self.max_bytes:
+                raise ImageFetchError(f"Image {path} is larger than {self.max_bytes} bytes")
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError as e:
+            raise ImageFetchError(f"Could not read image {path}: {e}") from e
+
+    def _download(self, img_url: str) -> bytes:
+        try:
+            with self.session.get(
+                img_url, stream=True, timeout=(IMAGE_FETCH_CONNECT_TIMEOUT, IMAGE_FETCH_READ_TIMEOUT)
+            ) as response:
+                response.raise_for_status()
+                if int(response.headers.get("Content-Length") or 0) > self.max_bytes:
+                    raise ImageFetchError(f"Image at {img_url} is larger than {self.max_bytes} bytes")
+                buffer = bytearray()
+                for chunk in response.iter_content(_CHUNK_SIZE):
+                    buffer.extend(chunk)
+                    if len(buffer) > self.max_bytes:
+                        raise ImageFetchError(f"Image at {img_url} is larger than {self.max_bytes} bytes")
+                return bytes(buffer)
+        except requests.RequestException as e:
+            raise ImageFetchError(f"Could not fetch image at {img_url}: {e}") from e
+
+    def _url_path(self, img_url: str) -> str:
+        return os.path.join(self.cache_dir, "urls", hashlib.sha256(img_url.encode("utf-8")).hexdigest())
+
+    def _cached_url(self, img_url: str):
+        # The url entry holds the content hash of the image last fetched from it
+        url_path = self._url_path(img_url)
+        try:
+            if time.time() - os.path.getmtime(url_path) > IMAGE_CACHE_URL_TTL_SECONDS:
+                return None
+            with open(url_path) as f:
+                content_path = os.path.join(self.cache_dir, f.read().strip())
+            with open(content_path, "rb") as f:
+                data = f.read()
+            os.utime(content_path)
+            return data
+        except OSError:
+            return None
+
+    def _store(self, img_url: str, data: bytes):
+        content_hash = hashlib.sha256(data).hexdigest()
+        with self._cache_lock:
+            content_path = os.path.join(self.cache_dir, content_hash)
+            if not os.path.exists(content_path):
+                with open(content_path + ".tmp", "wb") as f:
+                    f.write(data)
+                os.replace(content_path + ".tmp", content_path)
+            with open(self._url_path(img_url), "w") as f:
+                f.write(content_hash)
+            self._evict()
+
+    def _evict(self):
+        # Called with the lock held: drop the least recently used images beyond the size budget
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= IMAGE_CACHE_MAX_BYTES:
+                break
+            os.remove(path)
+            total -= size
+        now = time.time()
+        for entry in os.scandir(os.path.join(self.cache_dir, "urls")):
+            if now - entry.stat().st_mtime > IMAGE_CACHE_URL_TTL_SECONDS:
+                os.remove(entry.path)
+
+
+def decode_image(data: bytes, max_size: int = IMAGE_DECODE_MAX_SIZE) -> Image.Image:
+    """Decode image bytes to RGB with the longest side at most max_size.
+
+    JPEGs are decoded at a reduced DCT scale (draft mode), so a large photo is
+    never held in memory at full resolution.
+    """
+    try:
+        image = Image.open(BytesIO(data))
+        if image.width * image.height > IMAGE_MAX_PIXELS:
+            raise ImageFetchError(f"Image of {image.width}x{image.height} pixels exceeds {IMAGE_MAX_PIXELS} pixels")
+        image.draft("RGB", (max_size, max_size))
+        image.thumbnail((max_size, max_size))
+        return image.convert("RGB")
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ImageFetchError(f"Could not decode image: {e}") from e
+
+
+class ImageUploadStore:
+    """Uploaded images held in memory, least recently used dropped first beyond max_bytes.
+
+    An upload is written to directory by content hash only while a job holds
+    it (see hold and release), so it outlives the process for that job alone.
+    Copies older than max_age_seconds that no job holds are removed.
+    """
+
+    def __init__(self, max_bytes: int = IMAGE_UPLOAD_STORE_MAX_BYTES, directory: str = IMAGE_UPLOAD_DIR,
+                 max_age_seconds: int = IMAGE_UPLOAD_MAX_AGE_SECONDS):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_age_seconds = max_age_seconds
+        self._images = OrderedDict()  # content hash -> bytes
+        self._size = 0
+        self._holds = {}  # content hash -> number of unfinished jobs holding it
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def put(self, data: bytes) -> str:
+        content_hash = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self._remember(content_hash, data)
+        return UPLOAD_SCHEME + content_hash
+
+    def hold(self, img_url: str):
+        """Keep an upload on disk until release(); does nothing for other URLs"""
+        content_hash = self._try_content_hash(img_url)
+        if content_hash is None:
+            return
+        with self._lock:
+            self._holds[content_hash] = self._holds.get(content_hash, 0) + 1
+            path = os.path.join(self.directory, content_hash)
+            data = self._images.get(content_hash)
+            if os.path.exists(path):
+                os.utime(path)
+            elif data is not None:
+                with open(path + ".tmp", "wb") as f:
+                    f.write(data)
+                os.replace(path + ".tmp", path)
+            self._remove_expired()
+
+    def release(self, img_url: str):
+        """Drop a hold, removing the disk copy once no job holds the upload"""
+        content_hash = self._try_content_hash(img_url)
+        if content_hash is None:
+            return
+        with self._lock:
+            holds = self._holds.pop(content_hash, 0) - 1
+            if holds > 0:
+                self._holds[content_hash] = holds
+                return
+            path = os.path.join(self.directory, content_hash)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def get(self, ref: str) -> bytes:
+        content_hash = self._content_hash(ref)
+        with self._lock:
+            data = self._images.get(content_hash)
+            if data is not None:
+                self._images.move_to_end(content_hash)
+                return data
+            try:
+                with open(os.path.join(self.directory, content_hash), "rb") as f:
+                    data = f.read()
+            except OSError:
+                raise ImageFetchError(f"Uploaded image {ref} is no longer available")
+            self._remember(content_hash, data)
+            return data
+
+    def exists(self, ref: str) -> bool:
+        content_hash = self._try_content_hash(ref)
+        if content_hash is None:
+            return False
+        with self._lock:
+            return content_hash in self._images or os.path.exists(os.path.join(self.directory, content_hash))
+
+    def _content_hash(self, ref: str) -> str:
+        # Refs come from clients, so only well-formed hashes may become file names
+        match = _UPLOAD_REF_PATTERN.match(ref)
+        if match is None:
+            raise ImageFetchError(f"Invalid upload reference {ref}")
+        return match.group(1)
+
+    def _try_content_hash(self, ref: str):
+        try:
+            return self._content_hash(ref)
+        except ImageFetchError:
+            return None
+
+    def _remember(self, content_hash: str, data: bytes):
+        # Called with the lock held
+        if content_hash not in self._images:
+            self._images[content_hash] = data
+            self._size += len(data)
+        self._images.move_to_end(content_hash)
+        while self._size > self.max_bytes and len(self._images) > 1:
+            _, evicted = self._images.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _remove_expired(self):
+        # Called with the lock held
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name not in self._holds and now - entry.stat().st_mtime > self.max_age_seconds:
+                os.remove(entry.path)
+
+
+upload_store = ImageUploadStore()
+
+def store_upload(data: bytes, max_bytes: int = IMAGE_MAX_BYTES) -> str:
+    """Validate and downscale uploaded image bytes, returning an upload:// reference to them"""
+    if not data:
+        raise ImageFetchError("Uploaded image is empty")
+    if len(data) > max_bytes:
+        raise ImageFetchError(f"Uploaded image is larger than {max_bytes} bytes")
+    buffer = BytesIO()
+    decode_image(data).save(buffer, format="JPEG", quality=90)
+    return upload_store.put(buffer.getvalue())
+
+
+_image_fetcher = None
+_image_fetcher_lock = threading.Lock()
+
+def get_image_fetcher() -> ImageFetcher:
+    """Shared fetcher, so every caller uses the same connection pool"""
+    global _image_fetcher
+    with _image_fetcher_lock:
+        if _image_fetcher is None:
+            _image_fetcher = ImageFetcher()
+        return _image_fetcher
@@ -1,27 +1,168 @@
-import requests
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+import torch
 from PIL import Image
 from langchain_core.tools import tool
 from transformers import BlipProcessor, BlipForConditionalGeneration
+from scheduler import resource_limiter
+from job_context import check_cancelled
+from model_registry import model_registry
+from metrics import metrics
+from tools.image_fetch import decode_image, get_image_fetcher
+from tools.caption_batcher import CAPTION_BATCHING, CaptionBatcher
+from tools.captioner_backends import CAPTION_BACKEND, CAPTION_DEVICE, OnnxVisionEncoder, quantize_int8, resolve_device
+from dotenv import load_dotenv
+load_dotenv()
+
+# Images whose vision encodings are kept for follow-up prompts
+CAPTION_SESSION_CACHE_SIZE = int(os.getenv("CAPTION_SESSION_CACHE_SIZE", "16"))
+# How long a URL is assumed to point at the same image before it is downloaded again
+CAPTION_SESSION_URL_TTL_SECONDS = int(os.getenv("CAPTION_SESSION_URL_TTL_SECONDS", "300"))
+
+
+@dataclass
+class ImageSession:
+    """A decoded image and its BLIP vision-encoder output, shared by every prompt about it"""
+    content_hash: str
+    image: Image.Image
+    image_embeds: torch.Tensor = None
+
 
 class ImageCaptioning:
-    def __init__(self):
+    def __init__(self, session_cache_size: int = CAPTION_SESSION_CACHE_SIZE,
+                 device: str = CAPTION_DEVICE, backend: str = CAPTION_BACKEND):
+        self.backend = backend
+        self.device = resolve_device(device, backend)
         self.processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-large")
-        self.model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-large").to("cuda")
-    
+        model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-large").eval()
+        self.vision_encoder = None
+        if backend == "onnx":
+            self.vision_encoder = OnnxVisionEncoder(model.vision_model, model.config.vision_config.image_size, self.device)
+            # The torch vision encoder is no longer used, so only the text decoder moves to the device
+            model.text_decoder.to(self.device)
+            self.model = model
+        else:
+            if backend == "int8":
+                model = quantize_int8(model)
+            self.model = model.to(self.device)
+        print(f"Image captioner loaded: {backend} backend on {self.device}")
+        self.session_cache_size = session_cache_size
+        self._sessions = OrderedDict()  # content hash -> ImageSession
+        self._url_hashes = {}  # url -> (content hash, time seen)
+        self._sessions_lock = threading.Lock()
+
+    def read_image_bytes(self, img_url: str) -> bytes:
+        # URLs and local file paths, with timeouts, a size limit and an on-disk cache
+        return get_image_fetcher().fetch(img_url)
+
     def convert_raw_image(self, img_url: str) -> Image.Image:
-        if img_url.startswith(('http://', 'https://')):
-            return Image.open(requests.get(img_url, stream=True).raw).convert('RGB')
+        return decode_image(self.read_image_bytes(img_url))
+
+    def get_session(self, img_url: str) -> ImageSession:
+        """Session for the image at img_url, downloading and decoding it only when it is not cached"""
+        with self._sessions_lock:
+            seen = self._url_hashes.get(img_url)
+            if seen and time.time() - seen[1] < CAPTION_SESSION_URL_TTL_SECONDS and seen[0] in self._sessions:
+                self._sessions.move_to_end(seen[0])
+                metrics.increment("caption_session.hits")
+                return self._sessions[seen[0]]
+
+        data = self.read_image_bytes(img_url)
+        content_hash = hashlib.sha256(data).hexdigest()
+        with self._sessions_lock:
+            self._url_hashes[img_url] = (content_hash, time.time())
+            session = self._sessions.get(content_hash)
+            if session is not None:
+                self._sessions.move_to_end(content_hash)
+                metrics.increment("caption_session.hits")
+                return session
+
+        session = ImageSession(content_hash, decode_image(data))
+        with self._sessions_lock:
+            metrics.increment("caption_session.misses")
+            session = self._sessions.setdefault(content_hash, session)
+            while len(self._sessions) > self.session_cache_size:
+                evicted, _ = self._sessions.popitem(last=False)
+                self._url_hashes = {url: seen for url, seen in self._url_hashes.items() if seen[0] != evicted}
+            return session
+
+    def _encode_images(self, sessions: list):
+        """Run the vision encoder once over every session that has no embeddings yet"""
+        # Two threads may occasionally encode the same image; the results are identical
+        missing = list({id(s): s for s in sessions if s.image_embeds is None}.values())
+        if not missing:
+            return
+        pixel_values = self.processor(images=[s.image for s in missing], return_tensors="pt")["pixel_values"].to(self.device)
+        if self.vision_encoder is not None:
+            image_embeds = self.vision_encoder(pixel_values)
         else:
-            # Handle local file paths
-            return Image.open(img_url).convert('RGB')
-    
+            with torch.inference_mode():
+                image_embeds = self.model.vision_model(pixel_values=pixel_values)[0]
+        for session, embeds in zip(missing, image_embeds):
+            session.image_embeds = embeds.unsqueeze(0)
+
+    def caption_session(self, session: ImageSession, prompts: list) -> list:
+        """Caption one image with several prompts, running the vision encoder at most once"""
+        return self.caption_batch([(session, prompt) for prompt in prompts])
+
+    def caption_batch(self, items: list) -> list:
+        """Caption a list of (session, prompt) pairs, possibly for different images.
+
+        Mirrors BlipForConditionalGeneration.generate but feeds the cached image
+        embeddings to the text decoder. BLIP's decoder is not trained on padded
+        prompts, so prompts are batched by token length: pairs whose prompts have
+        equal length share a single generate call.
+        """
+        self._encode_images([session for session, _ in items])
+        text_config = self.model.config.text_config
+        encoded = [self.processor.tokenizer(prompt)["input_ids"] for _, prompt in items]
+
+        groups = {}
+        for index, input_ids in enumerate(encoded):
+            groups.setdefault(len(input_ids), []).append(index)
+
+        captions = [None] * len(items)
+        for indices in groups.values():
+            input_ids = torch.tensor([encoded[i] for i in indices], device=self.device)
+            input_ids[:, 0] = text_config.bos_token_id
+            embeds = torch.cat([items[i][0].image_embeds for i in indices])
+            with torch.inference_mode():
+                out = self.model.text_decoder.generate(
+                    input_ids=input_ids[:, :-1],
+                    eos_token_id=text_config.sep_token_id,
+                    pad_token_id=text_config.pad_token_id,
+                    encoder_hidden_states=embeds,
+                    encoder_attention_mask=torch.ones(embeds.shape[:-1], dtype=torch.long, device=self.device),
+                )
+            for i, caption in zip(indices, self.processor.batch_decode(out, skip_special_tokens=True)):
+                captions[i] = caption
+        return captions
+
     def conditional_image_captioning(self, text: str, raw_image: Image.Image) -> str:
         #conditional image captioning means we are providing a text prompt to the model
-        inputs = self.processor(raw_image, text, return_tensors="pt").to("cuda")
-        out = self.model.generate(**inputs)
-        return self.processor.decode(out[0], skip_special_tokens=True)
+        return self.caption_session(ImageSession(None, raw_image), [text])[0]
+
+model_registry.register("captioner", ImageCaptioning, policy="eager")
+
+def get_image_captioning() -> ImageCaptioning:
+    """Get the shared BLIP captioner, loading it on first use"""
+    return model_registry.get("captioner")
 
-image_captioning = ImageCaptioning()
+caption_batcher = CaptionBatcher(get_image_captioning)
+
+def caption_image(img_url: str, prompts: list) -> list:
+    """Caption an image with several prompts, batched with concurrent requests when CAPTION_BATCHING is on"""
+    image_captioning = get_image_captioning()
+    session = image_captioning.get_session(img_url)
+    check_cancelled()
+    if CAPTION_BATCHING:
+        return caption_batcher.caption(session, prompts)
+    with resource_limiter.acquire("captioner"):
+        return image_captioning.caption_session(session, prompts)
 
 @tool
 def get_image_caption(img_url: str, prompt: str = "An image of") -> str:
@@ -32,11 +173,22 @@ def get_image_caption(img_url: str, prompt: str = "An image of") -> str:
         Returns:
             A string with the caption of the image content
     """
-    raw_image = image_captioning.convert_raw_image(img_url)
-    return image_captioning.conditional_image_captioning(prompt, raw_image)
+    return caption_image(img_url, [prompt])[0]
+
+@tool
+def get_image_captions(img_url: str, prompts: list[str]) -> list[str]:
+    """Caption one image with several prompts at once, e.g. to ask about the setting, lighting and activity together.
+        Args:
+            img_url: The URL or local file path of the image to get the captions of
+            prompts: The prompts to condition each caption on, e.g. ["An image of", "The lighting is"]
+        Returns:
+            A list with one caption per prompt, in the same order
+    """
+    return caption_image(img_url, prompts)
 
 def get_local_context_tools():
     """Get all the local context tools for the agent"""
     tools = []
     tools.append(get_image_caption)
+    tools.append(get_image_captions)
     return tools
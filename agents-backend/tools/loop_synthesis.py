@@ -0,0 +1,95 @@
+"""
+Seamless loops for soundscapes longer than a single render
+
+StableAudio renders at most 15 seconds, so longer mixes are built from the
+stems themselves: each stem is cut at the point where it best matches its own
+opening (normalized cross-correlation), the tail past that point is blended
+into the start with an equal-power crossfade, and the resulting loop is tiled
+to the requested length from a random offset with a slow random gain drift
+between repeats. Any length costs the same diffusion time as the stems.
+"""
+
+import os
+import numpy as np
+from scipy.signal import correlate
+from tools.audio_mixer import MIX_FADE_SECONDS, MIX_NORMALIZATION, MIX_TARGET_LUFS, MIX_TARGET_PEAK_DB, normalize
+from dotenv import load_dotenv
+load_dotenv()
+
+LOOP_CROSSFADE_SECONDS = float(os.getenv("LOOP_CROSSFADE_SECONDS", "0.5"))
+# Loops are at least this long, and at least half their stem
+LOOP_MIN_SECONDS = float(os.getenv("LOOP_MIN_SECONDS", "4"))
+# Gain of each repeat drifts randomly within +/- this many dB
+LOOP_VARIATION_DB = float(os.getenv("LOOP_VARIATION_DB", "2"))
+# Longest mix that can be requested; a 30 minute stereo mix takes about 635 MB while rendering
+LOOP_MAX_DURATION_SECONDS = float(os.getenv("LOOP_MAX_DURATION_SECONDS", "1800"))
+
+
+def _as_2d(audio: np.ndarray) -> np.ndarray:
+    audio = np.asarray(audio, dtype=np.float32)
+    return audio[:, None] if audio.ndim == 1 else audio
+
+
+def find_loop_end(mono: np.ndarray, crossfade: int, min_length: int) -> int:
+    """Index from which the audio best resembles its first crossfade samples"""
+    template = mono[:crossfade].astype(np.float64)
+    search = mono[min_length:].astype(np.float64)
+    similarity = correlate(search, template, mode="valid", method="fft")
+    # Normalize by each candidate window's energy so loud passages are not favoured
+    energy = np.concatenate([[0.0], np.cumsum(search ** 2)])
+    window_energy = energy[crossfade:] - energy[:-crossfade]
+    score = similarity / np.sqrt(window_energy * np.dot(template, template) + 1e-12)
+    return min_length + int(np.argmax(score))
+
+
+def make_loop(audio: np.ndarray, sample_rate: int, crossfade_seconds: float = LOOP_CROSSFADE_SECONDS,
+              min_loop_seconds: float = LOOP_MIN_SECONDS) -> np.ndarray:
+    """Return a (samples, channels) loop of audio that repeats without a seam"""
+    audio = _as_2d(audio)
+    crossfade = max(min(int(crossfade_seconds * sample_rate), len(audio) // 4), 1)
+    min_length = min(max(int(min_loop_seconds * sample_rate), len(audio) // 2), len(audio) - crossfade)
+    end = find_loop_end(audio.mean(axis=1), crossfade, min_length)
+
+    # The loop wraps from end - 1 to 0, so its start fades from the audio after end into the real opening
+    t = (np.arange(crossfade) + 0.5) / crossfade
+    fade_in = np.sin(0.5 * np.pi * t).astype(np.float32)[:, None]
+    fade_out = np.cos(0.5 * np.pi * t).astype(np.float32)[:, None]
+    loop = audio[:end].copy()
+    loop[:crossfade] = audio[:crossfade] * fade_in + audio[end:end + crossfade] * fade_out
+    return loop
+
+
+def extend(loop: np.ndarray, samples: int, rng: np.random.Generator, variation_db: float = LOOP_VARIATION_DB) -> np.ndarray:
+    """Tile a loop to samples frames from a random offset, with a smooth gain drift between repeats"""
+    offset = int(rng.integers(len(loop)))
+    repeats = -(-(samples + offset) // len(loop))
+    tiled = np.tile(loop, (repeats, 1))[offset:offset + samples]
+    knots = np.arange(repeats + 1) * len(loop) - offset
+    gains = 10 ** (rng.uniform(-variation_db, variation_db, repeats + 1) / 20)
+    tiled *= np.interp(np.arange(samples), knots, gains).astype(np.float32)[:, None]
+    return tiled
+
+
+def loop_mix(stems: list, sample_rate: int, duration: float, gains_db: list = None, seed: int = None,
+             fade_seconds: float = MIX_FADE_SECONDS, normalization: str = MIX_NORMALIZATION,
+             target_peak_db: float = MIX_TARGET_PEAK_DB, target_lufs: float = MIX_TARGET_LUFS) -> np.ndarray:
+    """Mix looped stems into one float32 (samples, channels) array of duration seconds.
+
+    Normalized like audio_mixer.mix, with a fade at the start and end of the whole mix.
+    """
+    if duration > LOOP_MAX_DURATION_SECONDS:
+        raise ValueError(f"Mixes are limited to {LOOP_MAX_DURATION_SECONDS:.0f} seconds")
+    stems = [_as_2d(stem) for stem in stems]
+    samples = int(duration * sample_rate)
+    rng = np.random.default_rng(seed)
+    mixed = np.zeros((samples, max(stem.shape[1] for stem in stems)), dtype=np.float32)
+    for stem, gain_db in zip(stems, gains_db if gains_db is not None else [0.0] * len(stems)):
+        looped = extend(make_loop(stem, sample_rate), samples, rng)
+        looped *= np.float32(10 ** (gain_db / 20))
+        mixed += looped
+
+    fade = min(max(int(fade_seconds * sample_rate), 1), samples // 2)
+    ramp = ((np.arange(fade) + 1) / fade).astype(np.float32)[:, None]
+    mixed[:fade] *= ramp
+    mixed[len(mixed) - fade:] *= ramp[::-1]
+    return normalize(mixed, sample_rate, normalization, target_peak_db, target_lufs)
@@ -2,23 +2,69 @@ import os
 from langchain_core.tools import tool
 import torch
 import soundfile as sf
-from diffusers import BitsAndBytesConfig as DiffusersBitsAndBytesConfig, StableAudioDiTModel, StableAudioPipeline
+from diffusers import (
+    BitsAndBytesConfig as DiffusersBitsAndBytesConfig,
+    CosineDPMSolverMultistepScheduler,
+    StableAudioDiTModel,
+    StableAudioPipeline,
+)
 from transformers import BitsAndBytesConfig as BitsAndBytesConfig, T5EncoderModel
 import numpy as np
-from pydub import AudioSegment
+from scheduler import resource_limiter
+from job_context import JobCancelled, check_cancelled, current_job, emit_event
+from model_registry import model_registry
+from tools.prompt_embedding_cache import PromptEmbeddingCache
+from tools.diffusion_monitor import DiffusionMonitor
+from tools.audio_mixer import mix
+from tools.stem_store import get_stem_store
+from tools.artifact_store import artifact_store
+from tools.loop_synthesis import loop_mix
+from tools.stem_library import STEM_LIBRARY, StemLibrary, pool_embedding, vary
 
 # Fixed output directory - always use this same directory
 OUTPUT_DIR = "generated_tracks"
 
+# Layers rendered together in one pipeline call by generate_layers
+LAYER_BATCH_SIZE = int(os.getenv("LAYER_BATCH_SIZE", "4"))
+
+# Quality/latency presets: denoising steps, overrides of the default
+# CosineDPMSolverMultistepScheduler config, and the longest duration rendered (seconds).
+# The Karras sigma schedule spends the few draft steps where they matter most.
+QUALITY_PRESETS = {
+    "draft": {"steps": 10, "scheduler": {"sigma_schedule": "karras"}, "max_duration": 10},
+    "standard": {"steps": 50, "scheduler": {}, "max_duration": 15},
+    "high": {"steps": 100, "scheduler": {"solver_type": "heun"}, "max_duration": 15},
+}
+MUSIC_PRESET = os.getenv("MUSIC_PRESET", "standard")
+DEFAULT_SEED = 42
+NEGATIVE_PROMPT = "Low quality, distorted, noisy"
+
+def _quality(preset: str) -> int:
+    # Presets are listed from lowest to highest quality
+    return list(QUALITY_PRESETS).index(preset)
+
 class StableAudioSmall: 
-    def __init__(self):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+    def __init__(self, device: str = None):
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
         self._pipeline = None
+        self.prompt_embeddings = PromptEmbeddingCache()
+        self.diffusion_monitor = DiffusionMonitor()
+        self.stem_library = StemLibrary() if STEM_LIBRARY else None
         print(f"StableAudioSmall initialized on {self.device}")
 
     def _load_pipeline(self):
-        """Load the diffusers pipeline with 8-bit quantization"""
+        """Load the diffusers pipeline, with 8-bit quantization on GPU"""
         if self._pipeline is None:
+            if self.device == "cpu":
+                # bitsandbytes 8-bit layers need CUDA, so CPU runs the full-precision model
+                print("Loading Stable Audio pipeline on CPU...")
+                self._pipeline = StableAudioPipeline.from_pretrained(
+                    "stabilityai/stable-audio-open-1.0",
+                    torch_dtype=torch.float32,
+                )
+                print("Pipeline loaded on device: cpu")
+                return
+
             print("Loading Stable Audio pipeline with 8-bit quantization...")
             
             # Load quantized text encoder
@@ -49,43 +95,206 @@ class StableAudioSmall:
             )
             print(f"Pipeline loaded on device: {self._pipeline.device}")
 
-    def generate_music(self, prompt: str, duration: int = 11, file_name: str = "output", output_dir: str = OUTPUT_DIR) -> str:
+    def _loaded_pipeline(self) -> StableAudioPipeline:
+        """The shared pipeline, for its text encoder and VAE; renders go through _preset_pipeline"""
+        if self._pipeline is None:
+            self._load_pipeline()
+        return self._pipeline
+
+    def _preset_pipeline(self, preset: str) -> StableAudioPipeline:
+        """Pipeline sharing the loaded models, with a new scheduler configured for the preset.
+
+        Schedulers keep per-run state (timesteps, step index, solver history), so
+        every render gets its own instance and concurrent renders never share one.
+        """
+        pipeline = self._loaded_pipeline()
+        scheduler = CosineDPMSolverMultistepScheduler.from_config(
+            pipeline.scheduler.config, **QUALITY_PRESETS[preset]["scheduler"]
+        )
+        return StableAudioPipeline(**{**pipeline.components, "scheduler": scheduler})
+
+    def _step_callback(self, run):
+        """Pipeline callback run after every denoising step: aborts cancelled jobs and reports progress"""
+        def callback(step: int, timestep, latents):
+            check_cancelled()
+            run.step(step)
+        return callback
+
+    def _render(self, prompts: list, duration: float, preset: str = MUSIC_PRESET, seed: int = DEFAULT_SEED) -> list:
+        """Run one batched pipeline call over prompts, returning a (samples, channels) array per prompt.
+
+        The text encoder and DiT process the whole batch together. Each prompt gets its
+        own generator with the same seed, so a layer matches a solo render of the same
+        duration; layers trimmed from a longer batch render differ from a solo render.
+        """
+        pipeline = self._preset_pipeline(preset)
+        # T5 outputs come from the embedding cache; the pipeline only projects them
+        prompt_embeds, attention_mask = self.prompt_embeddings.encode(pipeline, prompts)
+        negative_embeds, negative_mask = self.prompt_embeddings.encode(pipeline, [NEGATIVE_PROMPT] * len(prompts))
+        # encode_prompt sets padding positions of the negative prompt to the null embedding
+        negative_embeds = torch.where(negative_mask.to(torch.bool).unsqueeze(2), negative_embeds, 0.0)
+        steps = QUALITY_PRESETS[preset]["steps"]
+        run = self.diffusion_monitor.start(
+            f"{preset.capitalize()} render", steps, (preset, len(prompts), round(duration), self.device)
+        )
+        audio = pipeline(
+            prompt_embeds=prompt_embeds,
+            negative_prompt_embeds=negative_embeds,
+            attention_mask=attention_mask,
+            negative_attention_mask=negative_mask,
+            num_inference_steps=steps,
+            audio_end_in_s=float(duration),
+            num_waveforms_per_prompt=1,
+            generator=[torch.Generator(device=self.device).manual_seed(seed) for _ in prompts],
+            callback=self._step_callback(run),
+            callback_steps=1,
+        ).audios
+        run.finish()
+        return [waveform.T.float().cpu().numpy() for waveform in audio]
+
+    def _store(self, output_audio: np.ndarray, file_name: str) -> str:
+        # Ensure file has .wav extension
+        if not file_name.endswith('.wav'):
+            file_name += '.wav'
+
+        # Kept in memory for overlay_audio_files; only the final mix is written to disk
+        sample_rate = self._pipeline.vae.sampling_rate
+        get_stem_store().put(file_name, output_audio, sample_rate)
+        # Live clients get every stem as soon as it exists, so playback can start before the mix
+        emit_event({"type": "stem", "name": file_name, "sample_rate": sample_rate, "audio": output_audio})
+        return file_name
+
+    def _render_layers(self, prompts: list, durations: list, file_names: list, preset: str, seed: int,
+                       remember: bool = True) -> list:
+        """Render layers in batches of up to LAYER_BATCH_SIZE prompts and store them, returning the stem names.
+
+        Each batch renders to its longest duration; shorter layers are trimmed afterwards.
+        Unless remember is False the layers are also added to the stem library.
+        """
+        written = []
+        for start in range(0, len(prompts), LAYER_BATCH_SIZE):
+            batch = slice(start, start + LAYER_BATCH_SIZE)
+            outputs = self._render(prompts[batch], max(durations[batch]), preset, seed)
+            outputs = [
+                output_audio[:int(duration * self._pipeline.vae.sampling_rate)]
+                for duration, output_audio in zip(durations[batch], outputs)
+            ]
+            for file_name, output_audio in zip(file_names[batch], outputs):
+                written.append(self._store(output_audio, file_name))
+            if remember and self.stem_library is not None:
+                self._remember(prompts[batch], durations[batch], outputs, preset)
+        return written
+
+    def _remember(self, prompts: list, durations: list, outputs: list, preset: str):
+        """Add rendered layers to the stem library"""
+        pipeline = self._loaded_pipeline()
+        embeddings = pool_embedding(*self.prompt_embeddings.encode(pipeline, prompts))
+        for prompt, duration, output_audio, embedding in zip(prompts, durations, outputs, embeddings):
+            self.stem_library.add(
+                embedding, output_audio, pipeline.vae.sampling_rate, prompt, duration, _quality(preset)
+            )
+
+    def _reuse_stems(self, prompts: list, durations: list, file_names: list, preset: str) -> dict:
+        """Store a varied library stem for every layer with a close enough match, returning {layer index: stem name}"""
+        pipeline = self._loaded_pipeline()
+        sample_rate = pipeline.vae.sampling_rate
+        embeddings = pool_embedding(*self.prompt_embeddings.encode(pipeline, prompts))
+        rng = np.random.default_rng()
+        reused = {}
+        for i, (embedding, duration, file_name) in enumerate(zip(embeddings, durations, file_names)):
+            found = self.stem_library.find(embedding, duration, _quality(preset), sample_rate)
+            if found is not None:
+                audio, metadata = found
+                print(f"Reusing library stem '{metadata['prompt']}' for '{prompts[i]}'")
+                reused[i] = self._store(vary(audio, sample_rate, int(duration * sample_rate), rng), file_name)
+        return reused
+
+    def _generate(self, prompts: list, durations: list, file_names: list):
+        """Render layers with the current job's preset and seed, returning (durations, stem names).
+
+        Layers whose prompt is close to one in the stem library reuse that stem
+        instead, unless the request asked for a specific seed. In progressive mode
+        a draft of every rendered layer is announced with a "draft" event before
+        the refined render starts.
+        """
+        job = current_job()
+        preset = (job.preset if job else None) or MUSIC_PRESET
+        seed = job.seed if job and job.seed is not None else DEFAULT_SEED
+        durations = [min(duration, QUALITY_PRESETS[preset]["max_duration"]) for duration in durations]
+
+        stem_names = {}
+        if self.stem_library is not None and not (job and job.seed is not None):
+            stem_names = self._reuse_stems(prompts, durations, file_names, preset)
+        pending = [i for i in range(len(prompts)) if i not in stem_names]
+        if pending:
+            pending_prompts = [prompts[i] for i in pending]
+            pending_durations = [durations[i] for i in pending]
+            pending_names = [file_names[i] for i in pending]
+            if job and job.progressive and preset != "draft":
+                draft_durations = [min(duration, QUALITY_PRESETS["draft"]["max_duration"]) for duration in pending_durations]
+                draft_names = [f"{os.path.splitext(name)[0]}_draft.wav" for name in pending_names]
+                drafts = self._render_layers(pending_prompts, draft_durations, draft_names, "draft", seed, remember=False)
+                emit_event({"type": "draft", "preset": "draft", "files": drafts})
+            rendered = self._render_layers(pending_prompts, pending_durations, pending_names, preset, seed)
+            stem_names.update(zip(pending, rendered))
+
+        return durations, [stem_names[i] for i in range(len(prompts))]
+
+    def generate_music(self, prompt: str, duration: int = 11, file_name: str = "output") -> str:
         """Generate music using the Diffusers StableAudio pipeline"""
         try:
-            # Create output directory if it doesn't exist
-            os.makedirs(output_dir, exist_ok=True)
-            
-            if self._pipeline is None:
-                self._load_pipeline()
-
-            duration = min(duration, 15)
-              
-            audio = self._pipeline(
-                prompt=prompt,
-                negative_prompt="Low quality, distorted, noisy",
-                num_inference_steps=50,
-                audio_end_in_s=float(duration),
-                num_waveforms_per_prompt=1,
-                generator=torch.Generator(device=self.device).manual_seed(42),
-            ).audios
-
-            output_audio = audio[0].T.float().cpu().numpy()
-            
-            # Ensure file has .wav extension
-            if not file_name.endswith('.wav'):
-                file_name += '.wav'
-                
-            file_path = os.path.join(output_dir, file_name)
-            sf.write(file_path, output_audio, self._pipeline.vae.sampling_rate)
+            durations, file_names = self._generate([prompt], [duration], [file_name])
             
-            return f"prompt: {prompt}, duration: {duration}, generated music: {file_name}"
+            return f"prompt: {prompt}, duration: {durations[0]}, generated music: {file_names[0]}"
             
+        except JobCancelled:
+            # Free the cancelled run's activations straight away for the next job
+            if self.device == "cuda":
+                torch.cuda.empty_cache()
+            raise
         except Exception as e:
             import traceback
             traceback.print_exc()
             return f"Error generating music: {str(e)}"
 
-stable_audio_small = StableAudioSmall()
+    def generate_layers(self, prompts: list, durations: list, file_names: list) -> str:
+        """Generate several layers, batching their prompts through the pipeline"""
+        try:
+            durations, file_names = self._generate(prompts, durations, file_names)
+            return "\n".join(
+                f"prompt: {prompt}, duration: {duration}, generated music: {file_name}"
+                for prompt, duration, file_name in zip(prompts, durations, file_names)
+            )
+
+        except JobCancelled:
+            if self.device == "cuda":
+                torch.cuda.empty_cache()
+            raise
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return f"Error generating layers: {str(e)}"
+
+def _load_stable_audio() -> StableAudioSmall:
+    model = StableAudioSmall()
+    model._load_pipeline()
+    return model
+
+model_registry.register("stable_audio", _load_stable_audio, policy="eager")
+
+def get_stable_audio() -> StableAudioSmall:
+    """Get the shared StableAudio model, loading the pipeline on first use"""
+    return model_registry.get("stable_audio")
+
+def job_output_dir() -> str:
+    """The current job's own output directory, or OUTPUT_DIR outside a job"""
+    job = current_job()
+    if job is None:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        return OUTPUT_DIR
+    if job.output_dir is None:
+        job.output_dir = artifact_store.job_dir(job.job_id)
+    return job.output_dir
 
 @tool
 def generate_music(prompt: str, duration: int = 11, file_name: str = "output") -> str:
@@ -97,48 +306,96 @@ def generate_music(prompt: str, duration: int = 11, file_name: str = "output") -
         Returns:
             A string with the prompt, duration, and the path to the generated music
     """
-    # Always use the same output directory
-    output_dir = OUTPUT_DIR
-    music = stable_audio_small.generate_music(prompt, duration, file_name, output_dir)
+    with resource_limiter.acquire("diffusion"):
+        # The job may have been cancelled while waiting for the GPU
+        check_cancelled()
+        music = get_stable_audio().generate_music(prompt, duration, file_name)
     return music
 
 @tool
-def overlay_audio_files(file_names: list[str]) -> str:
+def generate_layers(prompts: list[str], file_names: list[str], durations: list[int] = None) -> str:
+    """Generate several music layers at once, which is much faster than calling generate_music for each layer
+        Args:
+            prompts: One prompt per layer, each describing a single instrument or sound
+            file_names: One file name per layer. Include .wav extension.
+            durations: The duration of each layer in seconds, MAXIMUM 15. Defaults to 11 seconds for every layer.
+        Returns:
+            A string with the prompt, duration, and file name of each generated layer
+    """
+    if len(file_names) != len(prompts):
+        return "Error: provide exactly one file name per prompt"
+    durations = durations or [11] * len(prompts)
+    if len(durations) != len(prompts):
+        return "Error: provide exactly one duration per prompt"
+    with resource_limiter.acquire("diffusion"):
+        check_cancelled()
+        return get_stable_audio().generate_layers(prompts, durations, file_names)
+
+@tool
+def overlay_audio_files(file_names: list[str], gains_db: list[float] = None, duration: float = None) -> str:
     """Merge audio files into a single file. Only use this tool ONCE after all the audio files have been generated.
         Args:
             file_names: A list of file names to merge
+            gains_db: Optional volume of each file in decibels, e.g. [0, -6] to make the second file quieter. Default is 0 for every file.
+            duration: Optional length of the mix in seconds, e.g. 600 for 10 minutes. Files shorter than this are looped seamlessly. Default is the length of the longest file.
         Returns:
             A string with the path to the merged file
     """
-    # Always use the same directory
-    dir_path = OUTPUT_DIR
+    # Stems come from the job's stem store; files in the job's output directory are still accepted
+    store = get_stem_store()
+    dir_path = job_output_dir()
+    job = current_job()
+    # A length chosen with the request wins over the agent's
+    if job is not None and job.duration:
+        duration = job.duration
+    if duration is not None and duration <= 0:
+        return "Error: duration must be a positive number of seconds"
     try:
-        print(f"🎵 Merging {len(file_names)} audio files...")
+        print(f"Merging {len(file_names)} audio files...")
         
-        # Check if all files exist
+        # Check if all stems exist
         for file_name in file_names:
-            file_path = os.path.join(dir_path, file_name)
-            if not os.path.exists(file_path):
-                return f"Error: File {file_name} not found in {dir_path}"
+            if file_name not in store and not os.path.exists(os.path.join(dir_path, file_name)):
+                return f"Error: File {file_name} not found"
+        if gains_db is not None and len(gains_db) != len(file_names):
+            return "Error: provide exactly one gain per file"
         
-        audio_files = [AudioSegment.from_file(os.path.join(dir_path, file_name)) for file_name in file_names]
-        combined_audio = audio_files[0]
-        
-        for i, audio_file in enumerate(audio_files[1:], 1):
-            print(f"  Adding track {i+1}/{len(audio_files)}...")
-            combined_audio = combined_audio.overlay(audio_file)
+        stems = []
+        sample_rate = None
+        for file_name in file_names:
+            if file_name in store:
+                audio, rate = store.get(file_name)
+            else:
+                audio, rate = sf.read(os.path.join(dir_path, file_name), dtype="float32", always_2d=True)
+            if sample_rate is not None and rate != sample_rate:
+                return f"Error: {file_name} has sample rate {rate}, expected {sample_rate}"
+            sample_rate = rate
+            stems.append(audio)
         
-        # Export combined audio
-        combined_path = "combined_audio.wav"
-        combined_audio.export(combined_path, format="wav")
-        print(f"✅ Combined audio saved to: {combined_path}")
+        # Mixed in one NumPy pass; the mix is the only file written, then stored by content hash
+        if duration and duration * sample_rate > max(len(stem) for stem in stems):
+            seed = job.seed if job is not None else None
+            combined_audio = loop_mix(stems, sample_rate, duration, gains_db, seed=seed)
+        else:
+            if duration:
+                # Trimmed before mixing so the fade-out lands at the new end
+                stems = [stem[:int(duration * sample_rate)] for stem in stems]
+            combined_audio = mix(stems, sample_rate, gains_db)
+        combined_path = os.path.join(dir_path, "combined_audio.wav")
+        sf.write(combined_path, combined_audio, sample_rate)
+        artifact = artifact_store.put(combined_path)
+        if job is not None:
+            job.artifact = artifact
+            emit_event({"type": "mix", "artifact": artifact, "url": f"/jobs/{job.job_id}/audio"})
+        combined_path = artifact_store.path(artifact)
+        print(f"Combined audio saved to: {combined_path}")
         
-        # Clean up individual files
+        # Release the individual stems
         for file_name in file_names:
+            store.discard(file_name)
             file_path = os.path.join(dir_path, file_name)
             if os.path.exists(file_path):
                 os.remove(file_path)
-                print(f"Cleaned up: {file_name}")
         
         return combined_path
     except Exception as e:
@@ -149,5 +406,6 @@ def overlay_audio_files(file_names: list[str]) -> str:
 def get_generate_music_tools():
     tools = []
     tools.append(generate_music)
+    tools.append(generate_layers)
     tools.append(overlay_audio_files)
     return tools
\ No newline at end of file
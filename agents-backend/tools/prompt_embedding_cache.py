@@ -0,0 +1,80 @@
+"""
+LRU cache of T5 text-encoder outputs for StableAudio prompts
+
+Stem prompts repeat across generations and the negative prompt never changes,
+so their encoder hidden states are kept and passed to the pipeline as
+precomputed prompt_embeds / negative_prompt_embeds with their attention masks.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+import torch
+from metrics import metrics
+from dotenv import load_dotenv
+load_dotenv()
+
+PROMPT_EMBEDDING_CACHE_SIZE = int(os.getenv("PROMPT_EMBEDDING_CACHE_SIZE", "256"))
+
+
+def normalize_prompt(prompt: str) -> str:
+    # Case is kept: the T5 tokenizer is case-sensitive, so changing it would change the embedding
+    return " ".join(prompt.split())
+
+
+class PromptEmbeddingCache:
+    def __init__(self, max_entries: int = PROMPT_EMBEDDING_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # normalized prompt -> (hidden states, attention mask)
+        self._lock = threading.Lock()
+
+    def encode(self, pipeline, prompts: list):
+        """Return (hidden states [batch, seq, dim], attention mask [batch, seq]) for prompts.
+
+        Prompts not in the cache are encoded together in one text-encoder call,
+        tokenized exactly as StableAudioPipeline.encode_prompt does.
+        """
+        keys = [normalize_prompt(prompt) for prompt in prompts]
+        with self._lock:
+            cached = {key: self._entries[key] for key in keys if key in self._entries}
+            for key in cached:
+                self._entries.move_to_end(key)
+        misses = sum(key not in cached for key in keys)
+        metrics.increment("prompt_embedding_cache.hits", len(keys) - misses)
+        metrics.increment("prompt_embedding_cache.misses", misses)
+        missing = list(dict.fromkeys(key for key in keys if key not in cached))
+
+        if missing:
+            text_inputs = pipeline.tokenizer(
+                missing,
+                padding="max_length",
+                max_length=pipeline.tokenizer.model_max_length,
+                truncation=True,
+                return_tensors="pt",
+            )
+            device = pipeline._execution_device
+            attention_mask = text_inputs.attention_mask.to(device)
+            # no_grad rather than inference_mode: the cached tensors are reused by later pipeline calls
+            with torch.no_grad():
+                hidden_states = pipeline.text_encoder(text_inputs.input_ids.to(device), attention_mask=attention_mask)[0]
+            with self._lock:
+                for i, key in enumerate(missing):
+                    cached[key] = (hidden_states[i:i + 1].clone(), attention_mask[i:i + 1].clone())
+                    self._entries[key] = cached[key]
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        return (
+            torch.cat([cached[key][0] for key in keys]),
+            torch.cat([cached[key][1] for key in keys]),
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            "entries": entries,
+            "hits": metrics.counter("prompt_embedding_cache.hits"),
+            "misses": metrics.counter("prompt_embedding_cache.misses"),
+            "hit_rate": metrics.hit_rate("prompt_embedding_cache"),
+        }
@@ -3,7 +3,8 @@ import os
 from datetime import datetime
 from typing import Dict, List, Any, Optional
 from langchain_core.tools import tool
-from tools.vector_memory_tools import vector_memory_instance
+from tools.vector_memory_tools import get_vector_memory
+from model_registry import model_registry
 
 class ReinforcementLearning:
     def __init__(self):
@@ -60,7 +61,7 @@ class ReinforcementLearning:
         feedback["last_seen"] = datetime.now().isoformat()
         
         # Also store in vector memory for semantic search
-        vector_memory_instance.add_music_generation(
+        get_vector_memory().add_music_generation(
             context=context,
             environment=environment,
             music_prompt=f"Successful {music_style} music",
@@ -98,7 +99,7 @@ class ReinforcementLearning:
         feedback["last_seen"] = datetime.now().isoformat()
         
         # Also store in vector memory for semantic search
-        vector_memory_instance.add_music_generation(
+        get_vector_memory().add_music_generation(
             context=context,
             environment=environment,
             music_prompt=f"Unsuccessful {music_style} music",
@@ -156,7 +157,7 @@ class ReinforcementLearning:
         # Search for similar successful patterns
         search_query = f"{context} {environment} successful music"
         try:
-            results = vector_memory_instance.search_with_metadata(search_query, k=5)
+            results = get_vector_memory().search_with_metadata(search_query, k=5)
             
             for doc, score in results:
                 metadata = doc.metadata
@@ -197,8 +198,11 @@ class ReinforcementLearning:
         patterns.sort(key=lambda x: x["score"], reverse=True)
         return patterns[:limit]
 
-# Global reinforcement learning instance
-reinforcement_learning = ReinforcementLearning()
+# Global reinforcement learning instance, loaded on first use
+model_registry.register("reinforcement", ReinforcementLearning, policy="lazy")
+
+def get_reinforcement_learning() -> ReinforcementLearning:
+    return model_registry.get("reinforcement")
 
 @tool
 def record_positive_feedback(context: str, environment: str, music_style: str, user_rating: float = 1.0) -> str:
@@ -211,7 +215,7 @@ def record_positive_feedback(context: str, environment: str, music_style: str, u
         Returns:
             Confirmation that positive feedback was recorded
     """
-    return reinforcement_learning.record_positive_feedback(context, environment, music_style, user_rating)
+    return get_reinforcement_learning().record_positive_feedback(context, environment, music_style, user_rating)
 
 @tool
 def record_negative_feedback(context: str, environment: str, music_style: str, reason: str = "") -> str:
@@ -224,7 +228,7 @@ def record_negative_feedback(context: str, environment: str, music_style: str, r
         Returns:
             Confirmation that negative feedback was recorded
     """
-    return reinforcement_learning.record_negative_feedback(context, environment, music_style, reason)
+    return get_reinforcement_learning().record_negative_feedback(context, environment, music_style, reason)
 
 @tool
 def get_recommendation_weights(context: str, environment: str) -> str:
@@ -235,7 +239,7 @@ def get_recommendation_weights(context: str, environment: str) -> str:
         Returns:
             Weighted recommendations for music styles
     """
-    weights = reinforcement_learning.get_recommendation_weights(context, environment)
+    weights = get_reinforcement_learning().get_recommendation_weights(context, environment)
     
     if not weights:
         return "No learned patterns found for this context. Using default recommendations."
@@ -258,7 +262,7 @@ def get_learning_stats() -> str:
         Returns:
             Learning statistics and performance metrics
     """
-    stats = reinforcement_learning.get_learning_stats()
+    stats = get_reinforcement_learning().get_learning_stats()
     
     result = "Reinforcement Learning Statistics:\n"
     result += f"Total interactions: {stats['total_interactions']}\n"
@@ -281,7 +285,7 @@ def get_top_patterns(limit: int = 5) -> str:
         Returns:
             Top performing patterns with scores
     """
-    patterns = reinforcement_learning.get_top_patterns(limit)
+    patterns = get_reinforcement_learning().get_top_patterns(limit)
     
     if not patterns:
         return "No patterns learned yet. Start providing feedback to build recommendations!"
@@ -307,7 +311,7 @@ def search_similar_successful_patterns(context: str, environment: str, limit: in
     search_query = f"{context} {environment} successful music positive feedback"
     
     try:
-        results = vector_memory_instance.search_with_metadata(search_query, k=limit)
+        results = get_vector_memory().search_with_metadata(search_query, k=limit)
         
         if not results:
             return f"No similar successful patterns found for '{context}' in '{environment}'"
@@ -348,14 +352,14 @@ def learn_from_interaction(context: str, environment: str, music_prompt: str, us
     
     if any(word in feedback_lower for word in ['good', 'great', 'love', 'perfect', 'amazing', 'excellent']):
         # Positive feedback
-        result = reinforcement_learning.record_positive_feedback(
+        result = get_reinforcement_learning().record_positive_feedback(
             context, environment, music_style, rating or 1.0
         )
         result += "\n\nThis pattern will be reinforced for future recommendations."
         
     elif any(word in feedback_lower for word in ['bad', 'hate', 'terrible', 'awful', 'wrong', 'dislike']):
         # Negative feedback
-        result = reinforcement_learning.record_negative_feedback(
+        result = get_reinforcement_learning().record_negative_feedback(
             context, environment, music_style, user_feedback
         )
         result += "\n\nThis pattern will be avoided in future recommendations."
@@ -365,7 +369,7 @@ def learn_from_interaction(context: str, environment: str, music_prompt: str, us
         result = f"Recorded interaction: {music_style} for {environment} (neutral feedback)"
     
     # Get updated recommendations
-    weights = reinforcement_learning.get_recommendation_weights(context, environment)
+    weights = get_reinforcement_learning().get_recommendation_weights(context, environment)
     if weights:
         result += "\n\nUpdated recommendations for similar contexts:"
         sorted_weights = sorted(weights.items(), key=lambda x: x[1], reverse=True)
@@ -0,0 +1,151 @@
+"""
+Library of previously generated stems, looked up by prompt similarity
+
+Every rendered stem is kept with the pooled T5 embedding of its prompt (the
+same text-encoder output that conditions StableAudio) in a Chroma collection.
+Before rendering, a prompt within STEM_LIBRARY_MAX_DISTANCE (cosine) of a
+stored one that is at least as long and of at least the same quality preset
+reuses that stem instead, with a small random gain and pitch variation so
+repeated moods do not sound identical. Stems are stored as 16-bit FLAC, and
+the least recently used beyond STEM_LIBRARY_MAX_STEMS are evicted.
+
+The library is off by default: STEM_LIBRARY_MAX_DISTANCE has not been
+validated on real prompts, and too loose a threshold silently hands one
+prompt the stem of a different one. Check it against your own prompts
+before enabling it. Progressive drafts are never stored.
+"""
+
+import os
+import threading
+import time
+import uuid
+import numpy as np
+import soundfile as sf
+import torch
+import chromadb
+from metrics import metrics
+from dotenv import load_dotenv
+load_dotenv()
+
+STEM_LIBRARY = os.getenv("STEM_LIBRARY", "false").lower() == "true"
+STEM_LIBRARY_DIR = os.getenv("STEM_LIBRARY_DIR", "stem_library")
+# A 15 second stereo stem takes about 2.5 MB as FLAC
+STEM_LIBRARY_MAX_STEMS = int(os.getenv("STEM_LIBRARY_MAX_STEMS", "200"))
+# Cosine distance between prompt embeddings below which a stored stem is reused
+STEM_LIBRARY_MAX_DISTANCE = float(os.getenv("STEM_LIBRARY_MAX_DISTANCE", "0.05"))
+# Reused stems get a random gain within +/- this many dB and pitch within +/- this many semitones
+STEM_LIBRARY_GAIN_DB = float(os.getenv("STEM_LIBRARY_GAIN_DB", "1.5"))
+STEM_LIBRARY_PITCH_SEMITONES = float(os.getenv("STEM_LIBRARY_PITCH_SEMITONES", "0.5"))
+
+
+def pool_embedding(hidden_states: torch.Tensor, attention_mask: torch.Tensor) -> np.ndarray:
+    """Masked mean of T5 hidden states [batch, seq, dim], L2-normalized, as float32 [batch, dim]"""
+    mask = attention_mask.unsqueeze(2).to(hidden_states.dtype)
+    pooled = (hidden_states * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+    pooled = torch.nn.functional.normalize(pooled.float(), dim=1)
+    return pooled.cpu().numpy()
+
+
+def vary(audio: np.ndarray, sample_rate: int, samples: int, rng: np.random.Generator,
+         gain_db: float = STEM_LIBRARY_GAIN_DB, pitch_semitones: float = STEM_LIBRARY_PITCH_SEMITONES) -> np.ndarray:
+    """Return samples frames of audio with a random gain and a varispeed pitch shift.
+
+    Varispeed changes tempo along with pitch, so a shift up reads more source
+    frames; the stored stem must be long enough for that, otherwise the shift
+    is limited to what it can cover.
+    """
+    ratio = 2 ** (rng.uniform(-pitch_semitones, pitch_semitones) / 12)
+    ratio = min(ratio, len(audio) / samples)
+    positions = np.arange(samples) * ratio
+    varied = np.stack(
+        [np.interp(positions, np.arange(len(audio)), audio[:, channel]) for channel in range(audio.shape[1])],
+        axis=1,
+    )
+    gain = 10 ** (rng.uniform(-gain_db, gain_db) / 20)
+    return (varied * gain).astype(np.float32)
+
+
+class StemLibrary:
+    def __init__(self, directory: str = STEM_LIBRARY_DIR, max_stems: int = STEM_LIBRARY_MAX_STEMS,
+                 max_distance: float = STEM_LIBRARY_MAX_DISTANCE):
+        self.max_stems = max_stems
+        self.max_distance = max_distance
+        self.audio_dir = os.path.join(directory, "audio")
+        os.makedirs(self.audio_dir, exist_ok=True)
+        self._client = chromadb.PersistentClient(path=os.path.join(directory, "index"))
+        self._collection = self._client.get_or_create_collection("stems", metadata={"hnsw:space": "cosine"})
+        self._lock = threading.Lock()
+
+    def find(self, embedding: np.ndarray, duration: float, quality: int, sample_rate: int):
+        """Return (audio, metadata) of the closest stored stem that can stand in, or None"""
+        with self._lock:
+            if self._collection.count() == 0:
+                metrics.increment("stem_library.misses")
+                return None
+            result = self._collection.query(
+                query_embeddings=[embedding.tolist()],
+                n_results=1,
+                where={"$and": [
+                    {"duration": {"$gte": float(duration)}},
+                    {"quality": {"$gte": quality}},
+                    {"sample_rate": sample_rate},
+                ]},
+                include=["metadatas", "distances"],
+            )
+            if not result["ids"][0] or result["distances"][0][0] > self.max_distance:
+                metrics.increment("stem_library.misses")
+                return None
+            stem_id = result["ids"][0][0]
+            metadata = result["metadatas"][0][0]
+            try:
+                audio, _ = sf.read(os.path.join(self.audio_dir, f"{stem_id}.flac"), dtype="float32", always_2d=True)
+            except (OSError, sf.LibsndfileError):
+                # Audio removed behind the index's back
+                self._collection.delete(ids=[stem_id])
+                metrics.increment("stem_library.misses")
+                return None
+            self._collection.update(ids=[stem_id], metadatas=[{**metadata, "last_used": time.time()}])
+        metrics.increment("stem_library.hits")
+        return audio, metadata
+
+    def add(self, embedding: np.ndarray, audio: np.ndarray, sample_rate: int, prompt: str,
+            duration: float, quality: int):
+        stem_id = uuid.uuid4().hex
+        sf.write(os.path.join(self.audio_dir, f"{stem_id}.flac"), audio, sample_rate, "PCM_16", format="FLAC")
+        with self._lock:
+            self._collection.add(
+                ids=[stem_id],
+                embeddings=[embedding.tolist()],
+                metadatas=[{
+                    "prompt": prompt,
+                    "duration": float(duration),
+                    "quality": quality,
+                    "sample_rate": sample_rate,
+                    "last_used": time.time(),
+                }],
+            )
+            self._evict()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stems = self._collection.count()
+        return {
+            "stems": stems,
+            "hits": metrics.counter("stem_library.hits"),
+            "misses": metrics.counter("stem_library.misses"),
+            "hit_rate": metrics.hit_rate("stem_library"),
+        }
+
+    def _evict(self):
+        # Called with the lock held: drop the least recently used stems beyond capacity
+        excess = self._collection.count() - self.max_stems
+        if excess <= 0:
+            return
+        entries = self._collection.get(include=["metadatas"])
+        oldest = sorted(zip(entries["ids"], entries["metadatas"]), key=lambda entry: entry[1]["last_used"])[:excess]
+        stem_ids = [stem_id for stem_id, _ in oldest]
+        self._collection.delete(ids=stem_ids)
+        for stem_id in stem_ids:
+            path = os.path.join(self.audio_dir, f"{stem_id}.flac")
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,119 @@
+"""
+Request-scoped store of generated audio stems
+
+The music tools hand stems to each other by name through the current job's
+StemStore instead of writing and re-reading WAV files. Stems stay in memory
+up to STEM_STORE_MAX_BYTES per job; beyond that the least recently used are
+spilled to raw .npy files in a temporary directory, which is removed when the
+job finishes. Only the final mix is written as an audio file.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+import numpy as np
+from job_context import current_job
+from dotenv import load_dotenv
+load_dotenv()
+
+STEM_STORE_MAX_BYTES = int(os.getenv("STEM_STORE_MAX_BYTES", str(128 * 1024 * 1024)))
+# Parent directory of spill directories; defaults to the system temp directory
+STEM_SPILL_DIR = os.getenv("STEM_SPILL_DIR") or None
+
+
+class StemStore:
+    def __init__(self, max_bytes: int = STEM_STORE_MAX_BYTES, spill_dir: str = STEM_SPILL_DIR):
+        self.max_bytes = max_bytes
+        self.spill_parent = spill_dir
+        self._stems = OrderedDict()  # name -> (audio or None when spilled, sample rate)
+        self._spilled = {}  # name -> path of the spilled .npy file
+        self._size = 0
+        self._spill_dir = None
+        self._lock = threading.Lock()
+
+    def put(self, name: str, audio: np.ndarray, sample_rate: int):
+        with self._lock:
+            self._discard(name)
+            self._stems[name] = (audio, sample_rate)
+            self._size += audio.nbytes
+            self._spill_over_budget()
+
+    def get(self, name: str):
+        """Return (audio, sample_rate) for a stem, reading it back if it was spilled"""
+        with self._lock:
+            if name not in self._stems:
+                raise KeyError(f"No stem named {name}")
+            audio, sample_rate = self._stems[name]
+            if audio is None:
+                path = self._spilled.pop(name)
+                audio = np.load(path)
+                os.remove(path)
+                self._stems[name] = (audio, sample_rate)
+                self._size += audio.nbytes
+            self._stems.move_to_end(name)
+            self._spill_over_budget(keep=name)
+            return audio, sample_rate
+
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            return name in self._stems
+
+    def names(self) -> list:
+        with self._lock:
+            return list(self._stems)
+
+    def discard(self, name: str):
+        with self._lock:
+            self._discard(name)
+
+    def close(self):
+        """Drop every stem and delete the spill directory"""
+        with self._lock:
+            self._stems.clear()
+            self._spilled.clear()
+            self._size = 0
+            if self._spill_dir is not None:
+                shutil.rmtree(self._spill_dir, ignore_errors=True)
+                self._spill_dir = None
+
+    def _discard(self, name: str):
+        entry = self._stems.pop(name, None)
+        if entry is not None and entry[0] is not None:
+            self._size -= entry[0].nbytes
+        path = self._spilled.pop(name, None)
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+    def _spill_over_budget(self, keep: str = None):
+        # Called with the lock held: move least recently used stems to disk until under budget
+        for name in list(self._stems):
+            if self._size <= self.max_bytes:
+                break
+            audio, sample_rate = self._stems[name]
+            if audio is None or name == keep:
+                continue
+            if self._spill_dir is None:
+                self._spill_dir = tempfile.mkdtemp(prefix="stems_", dir=self.spill_parent)
+            path = os.path.join(self._spill_dir, f"{uuid.uuid4().hex}.npy")
+            np.save(path, audio)
+            self._spilled[name] = path
+            self._stems[name] = (None, sample_rate)
+            self._size -= audio.nbytes
+
+
+# Used outside a job, e.g. when tools are called directly from a script
+_default_store = StemStore()
+_store_lock = threading.Lock()
+
+def get_stem_store() -> StemStore:
+    """The current job's stem store, created on first use"""
+    job = current_job()
+    if job is None:
+        return _default_store
+    with _store_lock:
+        if job.stems is None:
+            job.stems = StemStore()
+        return job.stems
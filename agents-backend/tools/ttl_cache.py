@@ -0,0 +1,148 @@
+"""
+TTL cache with stampede protection and pluggable backends
+
+Backends store JSON-serializable values with an expiry:
+- MemoryCacheBackend: in-process LRU, the default and the stand-in for tests
+- RedisCacheBackend: shared between workers (needs the optional redis package)
+- NullCacheBackend: stores nothing, for benchmarks that must not hit a cache
+Select one with CACHE_BACKEND=memory|redis|none (and REDIS_URL).
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dotenv import load_dotenv
+load_dotenv()
+
+from metrics import metrics
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+class MemoryCacheBackend:
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl_seconds: float):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class RedisCacheBackend:
+    def __init__(self, url: str = REDIS_URL, prefix: str = "intelligent_ambience:"):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key: str):
+        raw = self._client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value, ttl_seconds: float):
+        self._client.set(self.prefix + key, json.dumps(value), ex=max(1, int(ttl_seconds)))
+
+    def delete(self, key: str):
+        self._client.delete(self.prefix + key)
+
+
+class NullCacheBackend:
+    def get(self, key: str):
+        return None
+
+    def set(self, key: str, value, ttl_seconds: float):
+        pass
+
+    def delete(self, key: str):
+        pass
+
+
+def create_cache_backend(kind: str = CACHE_BACKEND):
+    if kind == "memory":
+        return MemoryCacheBackend()
+    elif kind == "redis":
+        return RedisCacheBackend()
+    elif kind == "none":
+        return NullCacheBackend()
+    else:
+        raise ValueError(f"Unsupported cache backend: {kind}")
+
+
+def time_bucket(seconds: float, now: float = None) -> int:
+    """Index of the fixed-length time window containing now"""
+    return int((now if now is not None else time.time()) // seconds)
+
+
+class TTLCache:
+    """Read-through cache where concurrent misses for one key share a single computation"""
+
+    def __init__(self, name: str, ttl_seconds: float, backend=None):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend if backend is not None else create_cache_backend()
+        self._key_locks = {}  # key -> [lock, number of threads holding or waiting for it]
+        self._key_locks_lock = threading.Lock()
+
+    def get_or_compute(self, key: str, compute):
+        value = self.backend.get(key)
+        if value is not None:
+            metrics.increment(f"{self.name}.hits")
+            return value
+
+        with self._key_lock(key):
+            # Another thread may have filled the entry while we waited for the lock
+            value = self.backend.get(key)
+            if value is not None:
+                metrics.increment(f"{self.name}.hits")
+                return value
+            metrics.increment(f"{self.name}.misses")
+            value = compute()
+            if value is not None:
+                self.backend.set(key, value, self.ttl_seconds)
+            return value
+
+    def stats(self) -> dict:
+        return {
+            "hits": metrics.counter(f"{self.name}.hits"),
+            "misses": metrics.counter(f"{self.name}.misses"),
+            "hit_rate": metrics.hit_rate(self.name),
+        }
+
+    @contextmanager
+    def _key_lock(self, key: str):
+        with self._key_locks_lock:
+            entry = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            # The last user drops the lock so the table doesn't grow forever
+            with self._key_locks_lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._key_locks[key]
@@ -2,6 +2,7 @@ from langchain_ollama import OllamaEmbeddings
 from langchain_chroma import Chroma
 from langchain_core.tools import tool
 from datetime import datetime
+from model_registry import model_registry
 
 
 class VectorMemory:
@@ -50,7 +51,7 @@ def add_to_vector_store(text: str):
     Returns:
         "Text added to vector store"
     """
-    return vector_memory_instance.add_to_vector_store(text)
+    return get_vector_memory().add_to_vector_store(text)
 
 @tool
 def search_vector_store(text: str, k: int = 5):
@@ -62,7 +63,7 @@ def search_vector_store(text: str, k: int = 5):
     Returns:
         The most similar texts in the vector store
     """
-    results = vector_memory_instance.search_vector_store(text, k)
+    results = get_vector_memory().search_vector_store(text, k)
     return [doc.page_content for doc in results]
 
 @tool
@@ -86,7 +87,7 @@ def add_music_generation_memory(context: str, environment: str, music_prompt: st
         "user_feedback": user_feedback,
         "timestamp": datetime.now().isoformat()
     }
-    vector_memory_instance.add_to_vector_store(text, metadata)
+    get_vector_memory().add_to_vector_store(text, metadata)
     return f"Recorded music generation: {music_prompt} for {environment}"
 
 @tool
@@ -99,7 +100,7 @@ def search_music_memory(query: str, k: int = 5):
     Returns:
         Similar music generations with context
     """
-    results = vector_memory_instance.search_with_metadata(query, k)
+    results = get_vector_memory().search_with_metadata(query, k)
     if not results:
         return f"No similar music found for query: {query}"
     
@@ -135,7 +136,7 @@ def add_user_preference(key: str, value: str, category: str = "general"):
         "category": category,
         "timestamp": datetime.now().isoformat()
     }
-    vector_memory_instance.add_to_vector_store(text, metadata)
+    get_vector_memory().add_to_vector_store(text, metadata)
     return f"Remembered preference: {key} = {value} in category {category}"
 
 @tool
@@ -149,7 +150,7 @@ def search_preferences(query: str, category: str = "", k: int = 5):
     Returns:
         Found preferences with similarity scores
     """
-    results = vector_memory_instance.search_with_metadata(query, k)
+    results = get_vector_memory().search_with_metadata(query, k)
     if not results:
         return f"No preferences found for query: {query}"
     
@@ -195,7 +196,7 @@ def add_environment_pattern(location: str, time_of_day: str, environment_descrip
         "preferred_music_style": preferred_music_style,
         "timestamp": datetime.now().isoformat()
     }
-    vector_memory_instance.add_to_vector_store(text, metadata)
+    get_vector_memory().add_to_vector_store(text, metadata)
     return f"Learned pattern: {preferred_music_style} works well for {environment_description} in {location} at {time_of_day}"
 
 @tool
@@ -210,7 +211,7 @@ def search_environment_patterns(query: str, location: str = "", time_of_day: str
     Returns:
         Found environment patterns with similarity scores
     """
-    results = vector_memory_instance.search_with_metadata(query, k)
+    results = get_vector_memory().search_with_metadata(query, k)
     if not results:
         return f"No environment patterns found for query: {query}"
     
@@ -237,7 +238,11 @@ def search_environment_patterns(query: str, location: str = "", time_of_day: str
     
     return response
 
-vector_memory_instance = VectorMemory()
+model_registry.register("vector_memory", VectorMemory, policy="eager")
+
+def get_vector_memory() -> VectorMemory:
+    """Get the shared vector memory, opening the Chroma store on first use"""
+    return model_registry.get("vector_memory")
 
 def get_vector_memory_tools():
     """Get all vector memory tools for the intelligent ambience system"""
@@ -29,12 +29,17 @@ export default function Generate() {
     thinking,
     error: wsError,
     done,
+    layers,
+    mixUrl,
     connect,
     disconnect
   } = useWebSocket("ws://127.0.0.1:8000/ws/generate")
   
   // Time state for live updates
   const [currentTime, setCurrentTime] = useState(new Date())
+
+  // Last captured photo, uploaded with the next generation
+  const [photo, setPhoto] = useState<Blob | null>(null)
   
   const logEndRef = useRef<HTMLDivElement | null>(null);
 
@@ -64,11 +69,13 @@ export default function Generate() {
     console.log('Camera error:', cameraError);
   }, [stream, cameraLoading, cameraError])
 
-  const handleGenerate = () => {
+  const handleGenerate = async () => {
+    // Use the captured photo, or grab a frame now if the camera is running
+    const image = photo ?? (stream ? await takePhoto() : null)
     connect({
       query: location ? location.address : "Unknown location",
       img_url: "no image provided",
-    });
+    }, image);
   };
 
   const handleCancel = () => {
@@ -143,13 +150,13 @@ export default function Generate() {
             {stream && (
               <div className="flex gap-2 mt-2">
                 <Button onClick={async () => {
-                  const photo = await takePhoto()
-                  if (photo) {
-                    console.log('Photo taken:', photo)
-                    // Here you would send the photo to your API
+                  const captured = await takePhoto()
+                  if (captured) {
+                    console.log('Photo taken:', captured)
+                    setPhoto(captured)
                   }
                 }}>
-                  Capture
+                  {photo ? "Retake" : "Capture"}
                 </Button>
                 <Button onClick={switchCamera} variant="outline">
                   Switch Camera
@@ -168,6 +175,12 @@ export default function Generate() {
             <pre className="whitespace-pre-wrap break-words">{thinking}</pre>
             <div ref={logEndRef} />
           </div>
+          {layers.length > 0 && (
+            <div className="text-sm text-gray-600 mb-2">Playing {layers.length} layer{layers.length === 1 ? "" : "s"} while the mix is made</div>
+          )}
+          {mixUrl && (
+            <audio src={mixUrl} controls autoPlay loop className="w-full mb-4" />
+          )}
           <div className="flex gap-3">
             <Button
               onClick={handleGenerate}
@@ -6,6 +6,11 @@ interface WebSocketMessage {
   message?: string;
   step?: string;
   percent?: number;
+  steps_per_second?: number;
+  position?: number;
+  files?: string[];
+  name?: string;
+  url?: string;
 }
 
 export const useWebSocket = (url: string) => {
@@ -14,10 +19,48 @@ export const useWebSocket = (url: string) => {
   const [thinking, setThinking] = useState<string>("");
   const [error, setError] = useState<string | null>(null);
   const [done, setDone] = useState(false);
+  const [layers, setLayers] = useState<string[]>([]);
+  const [mixUrl, setMixUrl] = useState<string | null>(null);
   
   const wsRef = useRef<WebSocket | null>(null);
+  const audioContextRef = useRef<AudioContext | null>(null);
+  const sourcesRef = useRef<Map<string, AudioBufferSourceNode>>(new Map());
+  const startTimeRef = useRef(0);
+  // Name from the last "stem" header; its audio arrives in the next binary frame
+  const pendingStemRef = useRef<string | null>(null);
+  const mixReadyRef = useRef(false);
 
-  const connect = (data: Record<string, unknown>) => {
+  // HTTP base of the API, for the mix URL
+  const httpBase = url.replace(/^ws/, "http").replace(/\/ws\/.*$/, "");
+
+  const stopLayers = () => {
+    sourcesRef.current.forEach(source => source.stop());
+    sourcesRef.current.clear();
+    setLayers([]);
+  };
+
+  // Layers loop in step from when the first one arrived; a draft is replaced by its refined layer
+  const playLayer = async (name: string, data: ArrayBuffer) => {
+    const context = audioContextRef.current;
+    if (!context) return;
+    const buffer = await context.decodeAudioData(data);
+    if (mixReadyRef.current) return;
+    const layer = name.replace(/_draft\.wav$/, ".wav");
+    if (sourcesRef.current.size === 0) {
+      startTimeRef.current = context.currentTime;
+    }
+    sourcesRef.current.get(layer)?.stop();
+    const source = context.createBufferSource();
+    source.buffer = buffer;
+    source.loop = true;
+    source.connect(context.destination);
+    source.start(context.currentTime, (context.currentTime - startTimeRef.current) % buffer.duration);
+    sourcesRef.current.set(layer, source);
+    setLayers(Array.from(sourcesRef.current.keys()));
+  };
+
+  // An image, if given, is sent as a binary frame straight after the init message
+  const connect = (data: Record<string, unknown>, image?: Blob | null) => {
     // Close any existing socket first
     if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
       wsRef.current.close();
@@ -27,8 +70,17 @@ export const useWebSocket = (url: string) => {
     setStatus("connecting");
     setDone(false);
     setError(null);
+    stopLayers();
+    setMixUrl(null);
+    mixReadyRef.current = false;
+    pendingStemRef.current = null;
+
+    // Created here, inside the click that started generation, so the browser allows playback
+    audioContextRef.current ??= new AudioContext();
+    audioContextRef.current.resume();
 
     const ws = new WebSocket(url);
+    ws.binaryType = "arraybuffer";
     wsRef.current = ws;
 
     ws.onopen = () => {
@@ -36,11 +88,23 @@ export const useWebSocket = (url: string) => {
       setStatus("connected");
       ws.send(JSON.stringify({
         type: "init",
-        ...data
+        ...data,
+        has_image: Boolean(image)
       }));
+      if (image) {
+        ws.send(image);
+      }
     };
 
     ws.onmessage = (event) => {
+      if (event.data instanceof ArrayBuffer) {
+        const name = pendingStemRef.current;
+        pendingStemRef.current = null;
+        if (name) {
+          playLayer(name, event.data).catch(() => setError(`Could not play ${name}`));
+        }
+        return;
+      }
       const msg: WebSocketMessage = JSON.parse(event.data);
       switch (msg.type) {
         case "token":
@@ -49,14 +113,40 @@ export const useWebSocket = (url: string) => {
         case "status":
           setStatus(msg.message ?? "working...");
           break;
+        case "queue":
+          setStatus(`Queued (position ${msg.position ?? "?"})`);
+          break;
+        case "busy":
+          setError(msg.message ?? "Server is busy, please try again shortly");
+          setConnected(false);
+          ws.close();
+          break;
+        case "draft":
+          setStatus(`Draft ready (${msg.files?.length ?? 0} layers), refining...`);
+          break;
+        case "stem":
+          pendingStemRef.current = msg.name ?? null;
+          setStatus(`Layer ready: ${msg.name ?? ""}`);
+          break;
+        case "mix":
+          // The finished mix takes over from the individual layers
+          mixReadyRef.current = true;
+          stopLayers();
+          setMixUrl(`${httpBase}${msg.url}`);
+          break;
         case "progress":
-          setStatus(`${msg.step ?? "Processing"} ${msg.percent ?? 0}%`);
+          setStatus(`${msg.step ?? "Processing"} ${msg.percent ?? 0}%${msg.steps_per_second ? ` (${msg.steps_per_second} steps/s)` : ""}`);
           break;
         case "error":
           setError(msg.message ?? "Error");
           setConnected(false);
           ws.close();
           break;
+        case "cancelled":
+          setStatus("cancelled");
+          setConnected(false);
+          ws.close();
+          break;
         case "done":
           setDone(true);
           setConnected(false);
@@ -80,6 +170,7 @@ export const useWebSocket = (url: string) => {
       wsRef.current.send(JSON.stringify({ type: "cancel" }));
       wsRef.current.close();
     }
+    stopLayers();
   };
 
   // Cleanup on unmount
@@ -88,6 +179,8 @@ export const useWebSocket = (url: string) => {
       if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
         wsRef.current.close();
       }
+      sourcesRef.current.forEach(source => source.stop());
+      audioContextRef.current?.close();
     };
   }, []);
 
@@ -97,6 +190,8 @@ export const useWebSocket = (url: string) => {
     thinking,
     error,
     done,
+    layers,
+    mixUrl,
     connect,
     disconnect
   };